@@ -1,4 +1,4 @@
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import utils, Embed
 
 from dotenv import dotenv_values
@@ -16,21 +16,36 @@ sys.path.append("src/")
 
 import meden
 from crossplatform.debug import debug_print
-from crossplatform import core_types, network
+from crossplatform import core, core_types, metrics, network
 from crossplatform import core_exceptions as errors
-from monitor import Monitor
+from monitor import Monitor, Scheduler
+from dispatcher import Dispatcher
+from sharding import Coordinator
 
 config = dotenv_values(sys.path[0] + '/.env')
 BOT_KEY = config['key']
 CHANNEL = config['channel']
 MAINLOOP_TIME = config['interval']
+CONCURRENCY = int(config.get('concurrency', 0)) or None # collections fetched at once, from proxy count when not set
+WORKERS = int(config.get('workers', 8)) # threads for blocking work
+METRICS_PORT = int(config.get('metrics_port', 9400)) # local prometheus endpoint, 0 turns it off
+FEED = bool(int(config.get('feed', 0))) # read all collections from a few multi-collection queries instead of polling each
+SHARD_PORT = int(config.get('shard_port', 0)) # polling done by worker processes connected to the port, see src/sharding.py
+SHARD_HOST = config.get('shard_host', '127.0.0.1')
 
 network.load_proxies("proxies.txt")
 
 client = commands.Bot(command_prefix='.')
 
-magiceden = meden.Magiceden()
-monitor = Monitor(magiceden)
+magiceden = meden.Magiceden(
+    api=config.get('magiceden_api', meden.MAGICEDEN_API), # local stand-in for offline runs, see src/standin.py
+    rankPage=meden.Howrare(config.get('howrare_api', meden.HOWRARE_API)))
+
+if SHARD_PORT: # same interface, the collections and proxies are split between the workers
+    monitor = Coordinator(magiceden, network.read_proxies("proxies.txt"), SHARD_HOST, SHARD_PORT)
+else:
+    monitor = Monitor(magiceden, concurrency=CONCURRENCY, scheduler=Scheduler(interval=int(MAINLOOP_TIME)), workers=WORKERS, feed=FEED)
+
 monitor.load_collections("collections.txt")
 
 
@@ -54,6 +69,7 @@ def parse_kwargs(args): # -> tuple(dict, list):
 
 async def create_monitor(collectionId: str, rankId: str, **filters) -> str:
     try:
+        magiceden.get_collections(wait=False) # raises while the catalogue is missing, add_collection would wait for it
         monitor.add_collection(collectionId, rankId, **filters)
     except errors.NotValidQuerry:
         return f'Not valid collection'  # not valid collection
@@ -64,7 +80,12 @@ async def create_monitor(collectionId: str, rankId: str, **filters) -> str:
         debug_print(e, "Bot")
         return f'err other'
 
-    await monitor.update()
+    try:
+        await monitor.prime(collectionId)  # baseline for the new collection only
+    except errors.CustomErr as e:
+        debug_print(e.what(), "Bot")
+    except Exception as e:
+        debug_print(e, "Bot")
 
     print(f"Creatimng monitor for {collectionId}")
     return f'Monitor for `{collectionId}` **created**, `{len(monitor.collections)}` collections'
@@ -85,43 +106,64 @@ def delete_monitor(id: str) -> str:
     return f'Monitor for `{id}` **deleted**'
 
 
-async def update(channel):
-    try:
-        snapshots = await monitor.update()
-    except errors.CustomErr as e:
-        debug_print(e.what(), "Bot")
-        return
-    except Exception as e:
-        debug_print(e, "Bot")
-        return
+def render_nft(collectionID: str, nft: core.NFT) -> Embed:
+    lines = [
+        f'(Magiceden)[{monitor.marketPage.apis[core_types.MarketPageAPIs.nft_querry](nft.token)}]',
+        f'Rank: {nft.rank}',
+        f'Name: {nft.name}',
+        f'Price: **{nft.price}** SOL ',
+        'Attributes: ',
+    ]
+    lines += [f' \t - {att_pair["trait_type"]}: {att_pair["value"]} ' for att_pair in nft.atts]
 
-    if not snapshots:
-        return
+    embed = Embed()
+    embed.set_author(name=f"Rank; Price {nft.price} SOL")
+    # embed.set_thumbnail(url=nft['img'])
+    embed.set_image(url=nft.img)
+    embed.description = '\n'.join(lines).replace("\\", "")
 
-    print("Found in collections: ", [key for key in snapshots.keys()])
+    return embed
 
-    for collectionID, snapshot in snapshots.items():
-        for nft in snapshot.list:
-            info_string = f'''@everyone
-(Magiceden)[{monitor.marketPage.apis[core_types.MarketPageAPIs.nft_querry](nft.token)}]
-Rank: {nft.rank}
-Name: {nft.name}
-Price: **{nft.price}** SOL 
-Attributes: \n'''
 
-            for att_pair in nft.atts:
-                key = att_pair["trait_type"]
-                att_type = att_pair["value"]
+def render_stats() -> str:
+    def seconds(histogram: metrics.Histogram, *labels) -> str:
+        p50, p95 = (histogram.quantile(0.5, *labels), histogram.quantile(0.95, *labels))
+        return f'p50 {p50}s, p95 {p95}s' if p50 is not None else 'no data'
 
-                info_string += f' \t - {key}: {att_type} \n'
+    stats = monitor.stats()
+    lines = [
+        f'Collections: {len(monitor.collections)}, notifications sent: {int(metrics.notificationsTotal.get())}',
+        f'Poll: {seconds(metrics.pollSeconds)}, round: {seconds(metrics.roundSeconds)}',
+        f'Notification lag: {seconds(metrics.notificationLag)}',
+        f'Queues: ' + ', '.join(f'{stage} {depth}' for stage, depth in stats["queues"].items()),
+    ]
+
+    if "pool" in stats:
+        lines.append(f'Pool: {stats["pool"]["running"]}/{stats["pool"]["workers"]} busy, {stats["pool"]["queued"]} queued')
+
+    if "workers" in stats: # sharded, requests and proxies are in the metrics of the workers
+        lines.append(f'Workers: {len(stats["workers"])}')
+        lines += [f' - {name}: {worker["collections"]} collections, {worker["proxies"]} proxies, seen {worker["last_seen"]:.0f}s ago'
+            for name, worker in stats["workers"].items()]
+
+    lines.append('Requests:')
+
+    statuses = { }
+    for (endpoint, status), count in list(metrics.requestsTotal.values.items()):
+        statuses.setdefault(endpoint, []).append(f'{status}: {int(count)}')
+
+    for (endpoint,) in list(metrics.requestSeconds.values.keys()):
+        lines.append(f' - {endpoint}: {seconds(metrics.requestSeconds, endpoint)}, {", ".join(statuses.get(endpoint, []))}')
+
+    lines.append('Proxies:')
+    lines += [f' - {address}: {1 - proxy["errors"] / proxy["requests"]:.0%} ok of {proxy["requests"]}'
+        for address, proxy in network.proxyManager.stats().items() if proxy["requests"]]
+
+    return '\n'.join(lines)
 
-            embed = Embed()
-            embed.set_author(name=f"Rank; Price {nft.price} SOL")
-            # embed.set_thumbnail(url=nft['img'])
-            embed.set_image(url=nft.img)
-            embed.description = info_string.replace("\\", "")
 
-            await channel.send(embed=embed)
+dispatcher = Dispatcher(render_nft, monitor.subscribe(), content='@everyone')
+background = []  # monitor and dispatcher tasks
 
 # endregion
 
@@ -134,10 +176,14 @@ async def on_ready():
 
     channel = utils.get(client.get_all_channels(), name=CHANNEL)
 
-    seconds = int(time.time()) % 10
-    time.sleep(10 - seconds)
+    if background: # on_ready fires again after reconnects
+        return
+
+    background.append(client.loop.create_task(monitor.run()))
+    background.append(client.loop.create_task(dispatcher.run(channel)))
 
-    main_loop.start(channel)
+    if METRICS_PORT:
+        background.append(client.loop.create_task(metrics.serve(METRICS_PORT)))
 
 
 @client.command(help=': Check bot\'s latency')
@@ -152,6 +198,11 @@ async def ping(ctxt):
     await ctxt.send(f'{random.choice(ping_choices)}! {int(client.latency * 1e3)}ms')
 
 
+@client.command(help=': Timings of polls, requests and notifications')
+async def stats(ctxt):
+    await ctxt.send(f'```{render_stats()[:1900]}```')  # discord caps messages at 2000 characters
+
+
 @client.command(help=': Bot will repeat your text')
 async def say(ctxt, text):
     choice = random.randrange(0, 100)
@@ -214,14 +265,6 @@ async def delete(ctxt, id: str):
     await ctxt.send(text)
 
 
-@tasks.loop(seconds=int(10))
-async def main_loop(channel):
-    try:
-        await update(channel)
-    except Exception as e:
-        debug_print(f"Exception: {e.args}", "Bot")
-
-    print(f'Loop done {time.asctime()}')
 # endregion
 
 
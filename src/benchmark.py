@@ -0,0 +1,174 @@
+"""
+Offline benchmark of the monitor
+--------------------------------
+
+Starts the local stand-in (standin.py) in a child process for every collection
+count, polls all collections in Monitor.update rounds and reports:
+
+    round latency (mean / p95), requests per second, 429 share,
+    peak memory of the bot process, missed listing rate
+
+A listing is missed when it was created after the baseline round and before the
+start of the last round, but no notification for it came out of the monitor.
+
+    python src/benchmark.py --sizes 10 100 1000 5000 --rounds 5 --latency 0.05
+    python src/benchmark.py --sizes 500 --feed   # feed mode, a few requests per round
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import tempfile
+import time
+import urllib.request
+
+from typing import Dict, List
+
+import standin
+
+
+OUTPUT = "bench_output.txt"
+
+
+def memory() -> float:
+    "Peak resident memory of this process, MB, the measuring process runs one size only"
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0
+
+def fetch_stats(base: str, since: float = 0) -> Dict:
+    with urllib.request.urlopen(f"{base}/_bench/stats?since={since}") as response:
+        return json.loads(response.read())
+
+
+async def measure(size: int, args: argparse.Namespace, base: str) -> Dict:
+    # imported late, the working directory is the scratch one by now (logs, disk cache)
+    import meden
+    import monitor
+    from crossplatform import network
+
+    for i in range(args.proxies): # every "proxy" is the stand-in itself, distinct by credentials
+        network.proxyManager.add(network.Proxy(f"bench{i}:{size}@{base.split('://')[1]}"))
+
+    market = meden.Magiceden(api=base, url=f"{base}/marketplace/", rankPage=meden.Howrare(base))
+    # every collection due in every round
+    scheduler = monitor.Scheduler(tick=1, interval=0, minInterval=0, maxInterval=0, budget=10 ** 9)
+    mon = monitor.Monitor(market, concurrency=args.concurrency, scheduler=scheduler, notificationLimit=10 ** 7, feed=args.feed)
+    notifications = mon.subscribe()
+
+    for name in market.collections:
+        mon.add_collection(name, name)
+
+    await mon.update() # baseline, every listing seen here is old
+    baseline = time.time()
+    stats = fetch_stats(base)
+
+    durations = []
+    notified = set()
+    startTime = time.monotonic()
+
+    for _ in range(args.rounds):
+        await asyncio.sleep(args.pause)
+        lastRound = time.time()
+
+        roundStart = time.monotonic()
+        await mon.update()
+        durations.append(time.monotonic() - roundStart)
+
+        while not notifications.empty():
+            notified.add(notifications.get_nowait()[1].id)
+
+    elapsed = time.monotonic() - startTime
+    endStats = fetch_stats(base, baseline)
+
+    expected = {listingID for listings in endStats["listings"].values() for listingID, created in listings if created < lastRound}
+    requests = endStats["requests"] - stats["requests"]
+
+    mon.close()
+    mon.pool.shutdown(wait=True) # background rank downloads must not outlive the stand-in
+    network.proxyManager.proxies.clear()
+    await network.close_async_session()
+
+    return {
+        "collections": size,
+        "round_mean": sum(durations) / len(durations),
+        "round_p95": percentile(durations, 0.95),
+        "requests_per_s": requests / elapsed,
+        "throttled": (endStats["throttled"] - stats["throttled"]) / max(requests, 1),
+        "memory_mb": memory(),
+        "listings": len(expected),
+        "missed": len(expected - notified) / len(expected) if expected else 0,
+    }
+
+def measure_process(size: int, args: argparse.Namespace, base: str, results: multiprocessing.Queue):
+    """
+    Child process per size, peak memory and module state (proxies, rate limiter buckets,
+    metrics, disk cache) of one size don't leak into the next one
+    """
+    os.chdir(tempfile.mkdtemp(prefix=f"uzzi-bench-{size}-")) # cache and logs of the run stay out of the repo
+    results.put(asyncio.run(measure(size, args, base)))
+
+def run(size: int, args: argparse.Namespace) -> Dict:
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=standin.serve, daemon=True, args=(
+        standin.StandIn(size, args.rate, args.latency, args.jitter, args.throttle, args.limit), 0, ready))
+    server.start()
+
+    try:
+        base = f"http://127.0.0.1:{ready.get(timeout=60)}"
+
+        results = multiprocessing.Queue()
+        bench = multiprocessing.Process(target=measure_process, args=(size, args, base, results))
+        bench.start()
+
+        try:
+            while True:
+                try:
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    if not bench.is_alive():
+                        raise RuntimeError(f"Benchmark of {size} collections exited with code {bench.exitcode}")
+        finally:
+            bench.join()
+    finally:
+        server.kill()
+        server.join()
+
+def report(result: Dict) -> str:
+    return (f"{result['collections']:>6} collections | round {result['round_mean']:.3f}s mean {result['round_p95']:.3f}s p95 | "
+        f"{result['requests_per_s']:.0f} req/s, {result['throttled']:.1%} 429 | {result['memory_mb']:.0f} MB peak | "
+        f"missed {result['missed']:.1%} of {result['listings']} listings")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the monitor against the local stand-in")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="collection counts")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--pause", type=float, default=1, help="seconds between rounds")
+    parser.add_argument("--rate", type=float, default=0.05, help="new listings per second per collection")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--throttle", type=float, default=0, help="probability of 429")
+    parser.add_argument("--limit", type=float, default=0, help="requests per second before 429")
+    parser.add_argument("--proxies", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=None)
+    parser.add_argument("--feed", action="store_true", help="read the collections from multi-collection feed queries")
+    parser.add_argument("--output", default=OUTPUT)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+
+    with open(output, "a") as f:
+        f.write(f"{time.asctime()} {' '.join(sys.argv[1:])}\n")
+
+        for size in args.sizes:
+            line = report(run(size, args))
+            print(line)
+            f.write(line + "\n")
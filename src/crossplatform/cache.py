@@ -0,0 +1,164 @@
+"""
+On-disk cache shared by all bot processes on the host
+------------------------------------------------------
+
+Values are json documents in a SQLite database, keyed by string and stamped
+with the time they were fetched. WAL mode lets several processes read while
+one of them writes.
+
+* DiskCache \n
+    Class, key -> (value, fetched at) table with TTL
+* LRUCache \n
+    Class, in memory dict bounded by the accounted size of its values
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Any, Callable, Tuple
+from crossplatform import decoding
+
+
+CACHE_PATH = "temp/cache.sqlite"
+RANK_TTL = 24 * 60 * 60 # seconds, rank tables only change when howrare recalculates
+CATALOGUE_TTL = 60 * 60 # seconds, lists of all collections on a page
+FLOOR_TTL = 5 * 60 # seconds, floor stats are refreshed far less often than listings are polled
+RANK_MEMORY = 64 * 1024 * 1024 # bytes of rank tables kept in memory, the rest is read back from disk
+
+
+class DiskCache:
+    """
+    Parameters
+    ----------
+    table : str
+        Name of the SQLite table, one per kind of data
+    ttl : float
+        Seconds after which stored values are stale and should be revalidated
+    path : str
+        Path of the database file
+    """
+
+    def __init__(self, table: str, ttl: float, path: str = CACHE_PATH) -> None:
+        self.table = table
+        self.ttl = ttl
+        self.path = path
+
+        self.local = threading.local() # sqlite connections can't be shared between threads
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connection() as connection:
+            connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value TEXT, fetched REAL)")
+
+    def get(self, key: str) -> Tuple[Any, float]:
+        "Returns (value, fetched at) or (None, None) when the key is not stored"
+        row = self._connection().execute(
+            f"SELECT value, fetched FROM {self.table} WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            return (None, None)
+
+        return (decoding.loads(row[0]), row[1])
+
+    def set(self, key: str, value: Any, fetched: float = None):
+        fetched = fetched if fetched is not None else time.time()
+
+        with self._connection() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, fetched) VALUES (?, ?, ?)",
+                (key, decoding.dumps(value), fetched))
+
+    def remove(self, key: str):
+        with self._connection() as connection:
+            connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def is_stale(self, fetched: float) -> bool:
+        return fetched is None or time.time() - fetched > self.ttl
+
+# private:
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+
+        return connection
+
+
+class LRUCache:
+    """
+    Dict evicting the least recently used values once their total size is over the limit
+
+    Parameters
+    ----------
+    maxSize : int
+        Limit of the summed sizes, in the units `sizeof` returns (ussually bytes)
+    sizeof : Callable
+        Size of one value, computed once when it is inserted
+    """
+
+    def __init__(self, maxSize: int, sizeof: Callable[[Any], int] = lambda _: 1) -> None:
+        self.maxSize = maxSize
+        self.sizeof = sizeof
+
+        self.items = collections.OrderedDict() # key -> (value, size), oldest first
+        self.size = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.items
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key: Any, value: Any):
+        size = self.sizeof(value)
+
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+
+            self.items[key] = (value, size)
+            self.size += size
+
+            # the newest value stays even when it alone is over the limit
+            while self.size > self.maxSize and len(self.items) > 1:
+                _, (_, evictedSize) = self.items.popitem(last=False)
+                self.size -= evictedSize
+                self.evictions += 1
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        with self.lock:
+            if not key in self.items:
+                return default
+
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def pop(self, key: Any, default: Any = None) -> Any:
+        with self.lock:
+            if not key in self.items:
+                return default
+
+            value, size = self.items.pop(key)
+            self.size -= size
+
+            return value
+
+    def keys(self):
+        return list(self.items.keys())
@@ -12,10 +12,14 @@ Classes:
     Half - can be used as it is, but you can modify it \n
     Interface - use it as base for your custom class \n
 
+* TraitTable \n
+    Class, interned trait strings of one collection
 * NFT \n
     Class, stores data of your nft in cross-page/universal state
 * Snapshot \n
     Class, list of downloaded nfts
+* SnapshotDiff \n
+    Class, added/removed/repriced nfts between two Snapshots
 * Page \n
     Interface, stores data about your website
 * PageTuple \n
@@ -25,26 +29,82 @@ Classes:
 
 """
 
+import asyncio
+import sys
+import threading
+import time
+import numpy as np
+
 import crossplatform.core_exceptions as core_exceptions
+import crossplatform.rarity as rarity
+from crossplatform.cache import DiskCache, LRUCache, RANK_TTL, RANK_MEMORY, CATALOGUE_TTL, FLOOR_TTL
 from crossplatform.core_types import MarketPageAPIs 
-from typing import List, Dict, Callable
+from crossplatform.debug import debug_print
+from crossplatform.network import SingleFlight
+from typing import List, Dict, Set, Tuple, Callable
 
 
 REC_LIM = 5
+CATALOGUE_WAIT = 60 # seconds to wait for the first catalogue download
+CATALOGUE_RETRY = 30 # seconds, failed first download is tried again by an access after this
+INDEX_RETRY = 5 * 60 # seconds before a failed trait index build of a collection is tried again
+CATALOGUE_MIN_AGE = 60 # seconds, unknown collection refreshes a catalogue older than this (new launches)
 
 
+class TraitTable: pass
 class NFT: pass
 class Snapshot: pass
+class SnapshotDiff: pass
 
 class Page: pass
 class MarketPage(Page): pass
 class RankPage(Page): pass
 
 
+class TraitTable:
+    """
+    Interns trait type/value pairs of one collection into small integer codes
+
+    NFTs of the collection only keep tuples of the codes, the strings are 
+    stored once here.
+    """
+
+    def __init__(self) -> None:
+        self.pairs = [] # list [(trait type, value)], index is the code
+        self.codes = { } # dict [(trait type, value), code]
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    def code(self, traitType: str, value: str) -> int:
+        pair = (traitType, value)
+        code = self.codes.get(pair)
+
+        if code is not None:
+            return code
+
+        with self.lock:
+            if not pair in self.codes:
+                self.codes[pair] = len(self.pairs)
+                self.pairs.append((sys.intern(str(traitType)), sys.intern(str(value))))
+
+            return self.codes[pair]
+
+    def encode(self, attributes: List[Dict]) -> Tuple[int, ...]:
+        "Magiceden like attributes [{trait_type: ..., value: ...}, ...] to codes"
+        return tuple(self.code(att["trait_type"], att["value"]) for att in attributes)
+
+    def decode(self, codes: Tuple[int, ...]) -> List[Dict]:
+        return [{"trait_type": self.pairs[code][0], "value": self.pairs[code][1]} for code in codes]
+
+
 class NFT:
     "NFT class for easier cross platforming"
 
-    def __init__(self, id: str, name: str, token: str, price: float, image: str, rank: int, attributes: dict) -> None:
+    __slots__ = ("id", "name", "price", "img", "token", "rank", "traits", "traitTable", "listedAt")
+
+    def __init__(self, id: str, name: str, token: str, price: float, image: str, rank: int, attributes: List[Dict], traitTable: TraitTable = None, listedAt: float = None) -> None:
         """
         Parameters
         ----------
@@ -58,47 +118,142 @@ class NFT:
             URL of nft image
         rank : int
             Rank of nft, ussually won't come with raw nft data
-        attributes : dict
-            Dictionary of nft's attributes (ex. {Background: Red, ..., Hat: cylinder})
+        attributes : list
+            List of nft's attributes (ex. [{trait_type: Background, value: Red}, ...])
+        traitTable : TraitTable
+            Table of the nft's collection, attributes are stored as its codes
+        listedAt : float
+            Unix time the nft was listed at, when the page tells
         """
 
+        if traitTable is None:
+            traitTable = TraitTable()
+
         self.id = id
         self.name = name
         self.price = price
         self.img = image
         self.token = token
         self.rank = rank
-        self.atts = attributes
+        self.traits = traitTable.encode(attributes)
+        self.traitTable = traitTable
+        self.listedAt = listedAt
+
+    @property
+    def atts(self) -> List[Dict]:
+        return self.traitTable.decode(self.traits)
 
 
 class Snapshot:
     """
-    Snapshot of active page on market page
+    Snapshot of active page on market page, nfts are indexed by their id
     """
 
     def __init__(self, data: List[NFT], ids: List[str] = None) -> None:        
-        if not len(data):
-            ids = []
-        
         if not ids:
             ids = [nft.id for nft in data]
         
-        self.list = data
-        self.ids = ids
+        self.nfts = dict(zip(ids, data)) # dict [nft id, NFT]
+        self.columnCache = None
+
+    @property
+    def list(self) -> List[NFT]:
+        return list(self.nfts.values())
+
+    @property
+    def ids(self) -> List[str]:
+        return list(self.nfts.keys())
+
+    def __len__(self) -> int:
+        return len(self.nfts)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.nfts
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        Snapshot as numpy columns, row per nft in the order of self.list
+
+        price, rank (nan when unknown) - float arrays \n
+        traits - int matrix of trait codes, -1 padded \n
+        traitTable - TraitTable the codes belong to \n
+        """
+        if self.columnCache is not None:
+            return self.columnCache
+
+        nfts = self.list
+        width = max((len(nft.traits) for nft in nfts), default=0)
+
+        traits = np.full((len(nfts), width), -1, dtype=np.int32)
+        for row, nft in enumerate(nfts):
+            traits[row, :len(nft.traits)] = nft.traits
+
+        self.columnCache = {
+            "price": np.fromiter((nft.price for nft in nfts), dtype=np.float64, count=len(nfts)),
+            "rank": np.fromiter((nft.rank if nft.rank is not None else np.nan for nft in nfts), dtype=np.float64, count=len(nfts)),
+            "traits": traits,
+            "traitTable": nfts[0].traitTable if nfts else None,
+        }
+
+        return self.columnCache
+
+    def select(self, mask: np.ndarray) -> "Snapshot":
+        "Nfts whose row in self.columns() is True in the mask"
+        return Snapshot([nft for nft, valid in zip(self.list, mask) if valid])
 
     def __sub__(self, other: "Snapshot") -> "Snapshot":
         """
-        Get the difference between two Snapshots
+        Get nfts which are new in this Snapshot or got cheaper since the other one
         """
-        idsFinal = list(filter(lambda id: not id in other.ids, self.ids))
-        listFinal = [self.list[self.ids.index(id)] for id in idsFinal]
+        diff = self.diff(other)
+
+        return Snapshot(diff.added.list + diff.price_dropped().list)
+
+    def diff(self, other: "Snapshot") -> "SnapshotDiff":
+        """
+        Compare with older Snapshot in one pass over both of them
+        """
+        added = []
+        priceChanged = []
+        oldPrices = { }
+
+        for id, nft in self.nfts.items():
+            oldNft = other.nfts.get(id)
 
-        # TODO: check the price update
+            if oldNft is None:
+                added.append(nft)
+            elif oldNft.price != nft.price:
+                priceChanged.append(nft)
+                oldPrices[id] = oldNft.price
 
-        return Snapshot(listFinal, idsFinal)
+        removed = [nft for id, nft in other.nfts.items() if not id in self.nfts]
+
+        return SnapshotDiff(Snapshot(added), Snapshot(removed), Snapshot(priceChanged), oldPrices)
+
+    def isEmpty(self) -> bool:
+        return not len(self.nfts) 
+
+
+class SnapshotDiff:
+    """
+    Difference between new and old Snapshot
+
+    added - listed since the old snapshot \n
+    removed - delisted or sold since the old snapshot \n
+    priceChanged - in both, with a different price (new nft data), old prices in oldPrices \n
+    """
+
+    def __init__(self, added: Snapshot, removed: Snapshot, priceChanged: Snapshot, oldPrices: Dict[str, float]) -> None:
+        self.added = added
+        self.removed = removed
+        self.priceChanged = priceChanged
+        self.oldPrices = oldPrices # dict [nft id, price in the old snapshot]
+
+    def price_dropped(self) -> Snapshot:
+        return Snapshot([nft for nft in self.priceChanged.list if nft.price < self.oldPrices[nft.id]])
 
     def isEmpty(self) -> bool:
-        return not len(self.list) 
+        return self.added.isEmpty() and self.removed.isEmpty() and self.priceChanged.isEmpty()
 
 
 class Page:
@@ -115,67 +270,456 @@ class Page:
 
     """
 
-    def __init__(self, url: str, apis: Dict[int, Callable] = { }) -> None:
+    def __init__(self, url: str, apis: Dict[int, Callable] = { }, catalogueCache: DiskCache = None) -> None:
         self.url = f"{url}/" if not url[-1] == '/' else url 
         self.apis = apis
 
-        collections = self._parse_collections()
-        self.collections = collections if collections else []
-    
+        self.catalogue = None # list of collection ids, as the page returned them
+        self.catalogueFetched = None # unix time of the download
+        self.lookup = None # set built from catalogue on first use
+        self.catalogueError = None # failure of the last download while there is no catalogue, an access after CATALOGUE_RETRY retries
+        self.catalogueFailed = 0.0 # unix time of that failure
+        self.catalogueReady = threading.Event()
+        self.catalogueRefreshing = False
+        self.catalogueLock = threading.Lock()
+        self.flights = SingleFlight() # concurrent downloads of the same data done once
+        self.executor = None # shared pool for background work (concurrent.futures like), a thread per job when None
+        self.catalogueCache = catalogueCache if catalogueCache is not None else DiskCache("catalogues", CATALOGUE_TTL)
+
+        # start from the stored catalogue right away, download the current one in background
+        catalogue, fetched = self.catalogueCache.get(self.url)
+        if catalogue is not None:
+            self._set_catalogue(catalogue, fetched)
+
+        if self.catalogueCache.is_stale(fetched):
+            self.refresh_collections(background=True)
+
+    @property
+    def collections(self) -> Set[str]:
+        "Ids of all collections on the page, waits for the first download when nothing is cached, not for coroutines"
+        return self.get_collections()
+
+    def get_collections(self, wait: bool = True) -> Set[str]:
+        """
+        Ids of all collections on the page, stale catalogue is returned and refreshed in background
+
+        wait : bool
+            Wait up to CATALOGUE_WAIT for the first download (start up, worker threads),
+            coroutines pass False and get NetworkError while there is no catalogue yet
+        """
+        if self.catalogue is None:
+            if self.catalogueError is not None and time.time() - self.catalogueFailed > CATALOGUE_RETRY: # try again
+                self.refresh_collections(background=True)
+
+            if wait and not self.catalogueReady.wait(CATALOGUE_WAIT):
+                raise core_exceptions.NetworkError(f"Catalogue of {self.url} not loaded in {CATALOGUE_WAIT}s")
+
+            if self.catalogue is None:
+                error = self.catalogueError
+                raise error if error is not None else core_exceptions.NetworkError(f"Catalogue of {self.url} not loaded yet")
+        elif self.catalogueCache.is_stale(self.catalogueFetched):
+            self.refresh_collections(background=True)
+
+        lookup = self.lookup
+        if lookup is None:
+            lookup = self.lookup = set(self.catalogue)
+
+        return lookup
+
+    def refresh_collections(self, background: bool = False):
+        "Download the catalogue, does nothing while another download runs"
+        with self.catalogueLock:
+            if self.catalogueRefreshing:
+                return
+
+            self.catalogueRefreshing = True
+
+            if self.catalogue is None and self.catalogueError is not None: # retry, the callers wait for its result
+                self.catalogueError = None
+                self.catalogueReady.clear()
+
+        if background:
+            self._background(self._refresh_catalogue)
+        else:
+            self._refresh_catalogue()
+
     def request(self) -> str: raise core_exceptions.NotInitialized("Page: request")
     def parse(self, key: str): raise core_exceptions.NotInitialized("Page: parse")
     
 # private: 
     def _parse_collections(self) -> List[str]: raise core_exceptions.NotInitialized("Page: _parse_collections")
-    def _check_collection(self, collectionID: str): return collectionID in self.collections
+
+    def _check_collection(self, collectionID: str, wait: bool = True) -> bool:
+        if collectionID in self.get_collections(wait):
+            return True
+
+        # might have launched after the catalogue was downloaded, the next check finds it
+        if self.catalogueFetched is None or time.time() - self.catalogueFetched > CATALOGUE_MIN_AGE:
+            self.refresh_collections(background=True)
+
+        return False
+
+    def _refresh_catalogue(self):
+        try:
+            catalogue = self.flights.do("catalogue", self._parse_collections)
+            catalogue = catalogue if catalogue else []
+            fetched = time.time()
+
+            self.catalogueCache.set(self.url, catalogue, fetched)
+            self._set_catalogue(catalogue, fetched)
+        except Exception as e:
+            debug_print(e.what() if isinstance(e, core_exceptions.CustomErr) else e, "Page")
+
+            if self.catalogue is None: # nothing to fall back to, unblock the waiting callers with the error
+                self.catalogueFailed = time.time()
+                self.catalogueError = e if isinstance(e, core_exceptions.CustomErr) else core_exceptions.NetworkError(str(e))
+                self.catalogueReady.set()
+        finally:
+            with self.catalogueLock:
+                self.catalogueRefreshing = False
+
+    async def _run(self, target: Callable, *args):
+        "Await blocking call done in the executor, the loop's default one when there is none"
+        return await asyncio.get_running_loop().run_in_executor(self.executor, target, *args)
+
+    def _background(self, target: Callable, *args):
+        if self.executor is not None:
+            self.executor.submit(target, *args)
+        else:
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+    def _set_catalogue(self, catalogue: List[str], fetched: float):
+        self.lookup = None
+        self.catalogue = catalogue
+        self.catalogueFetched = fetched
+        self.catalogueError = None
+        self.catalogueReady.set()
 
 
 class MarketPage(Page):
-    def __init__(self, url: str, apis: Dict[int, Callable] = { }) -> None:
-        super().__init__(url, apis)
+    def __init__(self, url: str, apis: Dict[int, Callable] = { }, catalogueCache: DiskCache = None, floorCache: DiskCache = None) -> None:
+        super().__init__(url, apis, catalogueCache)
 
         self.lastSnap = { }
+        self.traitTables = { } # dict [collectionId, TraitTable]
+        self.rankPage = None # RankPage used to rank the listings
+
+        self.floors = { } # dict [collectionId, (floor, fetched at)], fetched at None once invalidated
+        self.floorCache = floorCache if floorCache is not None else DiskCache("floors", FLOOR_TTL)
+        self.floorTasks = { } # dict [collectionId, asyncio.Task], background floor refreshes
+
+    def get_trait_table(self, collectionId: str) -> TraitTable:
+        if not collectionId in self.traitTables:
+            self.traitTables.setdefault(collectionId, TraitTable())
+
+        return self.traitTables[collectionId]
 
     def get_snapshot(self, collectionId: str) -> Snapshot: raise core_exceptions.NotInitialized("MarketPage: get_snapshot")
+    async def async_get_snapshot(self, collectionId: str) -> Snapshot: raise core_exceptions.NotInitialized("MarketPage: async_get_snapshot")
+
+    # stages of get_snapshot, for pipelined polling
+    async def async_fetch_listings(self, collectionId: str) -> List[Dict]: raise core_exceptions.NotInitialized("MarketPage: async_fetch_listings")
+    async def async_rank_listings(self, collectionId: str, rankId: str, data: List[Dict]) -> Snapshot: raise core_exceptions.NotInitialized("MarketPage: async_rank_listings")
+    def diff_listings(self, collectionId: str, data: List[Dict], snapshot: Snapshot) -> Snapshot: raise core_exceptions.NotInitialized("MarketPage: diff_listings")
+
+    # all collections in a few requests instead of one per collection, {collectionId: raw listings} for the rank stage
+    async def async_fetch_feed(self, collectionIds: List[str]) -> Dict[str, List[Dict]]: raise core_exceptions.NotInitialized("MarketPage: async_fetch_feed")
+
+    async def async_get_floor(self, collectionId: str) -> float: raise core_exceptions.NotInitialized("MarketPage: async_get_floor")
+
+    async def async_get_floor_stats(self, collectionId: str, wait: bool = False) -> Tuple[float, float]:
+        """
+        (floor, fetched at) from memory, disk or the page, in this order
+
+        Stale floors are returned right away and refreshed in background,
+        the page is awaited only when the floor of the collection was never fetched
+
+        wait : bool
+            Await the refresh of a stale floor instead
+        """
+        floor, fetched = self.floors.get(collectionId, (None, None))
+
+        if collectionId not in self.floors:
+            # not in memory yet, disk is shared with the other processes
+            floor, fetched = self.floorCache.get(collectionId)
+
+            if fetched is None:
+                return await self._async_refresh_floor(collectionId)
+
+            self.floors[collectionId] = (floor, fetched)
+
+        if self.floorCache.is_stale(fetched):
+            if wait:
+                return await self._async_refresh_floor(collectionId)
+
+            self._refresh_floor_background(collectionId)
+
+        return (floor, fetched)
+
+    def undercut(self, collectionId: str, price: float) -> bool:
+        "Listing at the price came in, invalidates the cached floor when the listing is under it"
+        floor, fetched = self.floors.get(collectionId, (None, None))
+
+        if floor is None or fetched is None or price >= floor:
+            return False
+
+        self.floors[collectionId] = (floor, None) # kept as the fallback until the refresh finishes
+        self.floorCache.remove(collectionId)
+
+        return True
+
+# private:
+    async def _async_refresh_floor(self, collectionId: str) -> Tuple[float, float]:
+        floor = await self.flights.async_do(("floor", collectionId), self.async_get_floor, collectionId)
+        fetched = time.time()
+
+        self.floors[collectionId] = (floor, fetched)
+        self.floorCache.set(collectionId, floor, fetched)
+
+        return (floor, fetched)
+
+    def _refresh_floor_background(self, collectionId: str):
+        if collectionId in self.floorTasks:
+            return
+
+        async def refresh():
+            try:
+                await self._async_refresh_floor(collectionId)
+            except core_exceptions.CustomErr as e:
+                debug_print(e.what(), "MarketPage")
+            except Exception as e:
+                debug_print(e, "MarketPage")
+
+        self.floorTasks[collectionId] = asyncio.ensure_future(refresh())
+        self.floorTasks[collectionId].add_done_callback(lambda _: self.floorTasks.pop(collectionId, None))
 
 
 class RankPage(Page):
-    def __init__(self, url: str, apis: Dict[int, Callable] = None) -> None:
-        super().__init__(url, apis)
+    def __init__(self, url: str, apis: Dict[int, Callable] = None, rankCache: DiskCache = None, catalogueCache: DiskCache = None) -> None:
+        super().__init__(url, apis, catalogueCache)
+
+        self.collectionsData = LRUCache(RANK_MEMORY, lambda collection: collection["ranks"].nbytes + 4096) # collectionId: collection obj
+        self.fetched = { } # dict [collectionId, time the collection obj was downloaded]
 
-        self.collectionsData = { } # dict [collectionId, collection obj]
+        self.rankCache = rankCache if rankCache is not None else DiskCache("ranks", RANK_TTL)
+        self.revalidating = set() # collections being refreshed in background
+        self.lock = threading.Lock()
+
+        self.traitIndexes = { } # dict [collectionId, rarity.TraitIndex], full ones or from the seen listings
+        self.indexing = set() # collections whose full trait index is built in background
+        self.indexFailed = { } # dict [collectionId, time the last build failed]
 
     def get_rank(self, collection: str or Dict, nftId: str) -> int: 
-        if type(collection) == dict: # use the passed collection
-            return collection.get_rank(nftId)
+        "Collection is its id or the data (async_)get_collection_data returned, which is used as is"
+        if type(collection) != dict:
+            # the caller checked the catalogue already, it doesn't wait here
+            if not collection in self.get_collections(wait=False) and collection in self.traitIndexes: # not on the page, rank locally, None until enough is seen
+                return self.traitIndexes[collection].rank(nftId.split('#')[-1])
 
-        coll_data = self.get_collection_data(collection)
-        
-        # TODO: check this func for errors
-        def get_rank(nftID: str) -> int:
-            nftID = nftID.split('#')[-1]
+            collection = self.get_collection_data(collection)
 
-            if not nftID in coll_data["ranks"].keys():
-                collectionID = coll_data["data"]["name"]
-                raise core_exceptions.NotValidQuerry(f"{collectionID}; {nftID}")
+        nftID = nftId.split('#')[-1]
+        rank = collection["ranks"].get(nftID)
 
-            return coll_data["ranks"][nftID]
+        if rank is None:
+            raise core_exceptions.NotValidQuerry(f"{collection['data']['name']}; {nftID}")
 
-        return get_rank(nftId)
+        return rank
 
     def get_collection_data(self, collectionID: str) -> Dict:
         # get collection object from id
         if not collectionID in self.collections:
             raise core_exceptions.NotValidQuerry(collectionID)
         
-        if collectionID in self.collectionsData.keys():
-            return self.collectionsData[collectionID]
+        collection = self._get_cached_data(collectionID)
+        if collection is not None:
+            return collection
 
-        collection = self._get_collection_data(collectionID)
-        self.collectionsData[collectionID] = collection
+        return self.flights.do(collectionID, self._download_collection_data, collectionID, True)
 
-        return collection
+    async def async_get_collection_data(self, collectionID: str) -> Dict:
+        if not collectionID in self.get_collections(wait=False):
+            raise core_exceptions.NotValidQuerry(collectionID)
+
+        collection = self._get_memory_data(collectionID)
+        if collection is not None:
+            return collection
+
+        # sqlite read, json decoding and the RankTable build stay out of the loop
+        collection = await self._run(self._load_cached_data, collectionID)
+        if collection is not None:
+            return collection
+
+        return await self.flights.async_do(collectionID, self._async_download_collection_data, collectionID)
+
+    def get_trait_index(self, collectionID: str, wait: bool = True) -> "rarity.TraitIndex":
+        """
+        Trait index of the whole collection, built from the page's full collection data
+
+        wait : bool
+            Build it in this thread, coroutines pass False and get None until the background build is done
+        """
+        index = self.traitIndexes.get(collectionID)
+        if index is not None and index.complete:
+            return index
+
+        if not collectionID in self.get_collections(wait):
+            raise core_exceptions.NotValidQuerry(collectionID)
+
+        if wait:
+            return self.flights.do(("index", collectionID), self._build_trait_index, collectionID)
+
+        with self.lock:
+            if collectionID in self.indexing or time.time() - self.indexFailed.get(collectionID, 0) < INDEX_RETRY:
+                return None
+
+            self.indexing.add(collectionID)
+
+        self._background(self._index_worker, collectionID)
+
+        return None
+
+    def index_listings(self, collectionID: str, listings: List[Tuple[str, List[Dict]]]):
+        "Add (nft name, attributes) of seen listings to the local index of the collection"
+        if not collectionID in self.traitIndexes:
+            self.traitIndexes.setdefault(collectionID, rarity.TraitIndex())
+
+        index = self.traitIndexes[collectionID]
+        for name, attributes in listings:
+            index.add(name.split('#')[-1], attributes)
+
+    def preload(self, collectionIDs: List[str]):
+        """
+        Warm start, load stored collections to memory and fetch the missing ones in background
+        """
+        try:
+            collections = self.get_collections(wait=False) # called from coroutines, warm start is skipped without a catalogue
+        except core_exceptions.CustomErr:
+            return
+
+        for collectionID in collectionIDs:
+            if not collectionID in collections:
+                continue
+
+            if self._get_cached_data(collectionID) is None:
+                self._revalidate(collectionID)
 
 
 # private: 
     def _get_collection_data(self, collectionId: str) -> Dict: pass
+    async def _async_get_collection_data(self, collectionId: str) -> Dict: raise core_exceptions.NotInitialized("RankPage: _async_get_collection_data")
+    def _get_collection_items(self, collectionId: str) -> List[Tuple[str, List[Dict], int]]: raise core_exceptions.NotInitialized("RankPage: _get_collection_items")
+
+    def _download_collection_data(self, collectionID: str, useMemory: bool = False) -> Dict:
+        "Leader of the single flight, useMemory skips the download when a previous flight just stored the data"
+        collection = self.collectionsData.get(collectionID) if useMemory else None
+        if collection is not None:
+            return collection
+
+        return self._store_collection_data(collectionID, self._get_collection_data(collectionID))
+
+    async def _async_download_collection_data(self, collectionID: str) -> Dict:
+        collection = self.collectionsData.get(collectionID)
+        if collection is not None:
+            return collection
+
+        return await self._run(self._store_collection_data, collectionID, await self._async_get_collection_data(collectionID))
+
+    def _build_trait_index(self, collectionID: str) -> "rarity.TraitIndex":
+        index = rarity.TraitIndex()
+        for token, attributes, rank in self._get_collection_items(collectionID):
+            index.add(token, attributes, rank)
+
+        # built here, queries from the loop only do the bitwise ands
+        index.complete = True
+        index.prepare()
+
+        self.traitIndexes[collectionID] = index
+
+        return index
+
+    def _index_worker(self, collectionID: str):
+        try:
+            self.flights.do(("index", collectionID), self._build_trait_index, collectionID)
+        except core_exceptions.CustomErr as e:
+            self.indexFailed[collectionID] = time.time()
+            debug_print(e.what(), "RankPage")
+        except Exception as e:
+            self.indexFailed[collectionID] = time.time()
+            debug_print(e, "RankPage")
+        finally:
+            with self.lock:
+                self.indexing.discard(collectionID)
+
+    def _cache_key(self, collectionID: str) -> str:
+        return f"{self.url}{collectionID}"
+
+    def _get_cached_data(self, collectionID: str) -> Dict:
+        "Collection data from memory or disk, stale data is returned and revalidated in background"
+        collection = self._get_memory_data(collectionID)
+
+        return collection if collection is not None else self._load_cached_data(collectionID)
+
+    def _get_memory_data(self, collectionID: str) -> Dict:
+        collection = self.collectionsData.get(collectionID)
+
+        if collection is not None and self.rankCache.is_stale(self.fetched.get(collectionID)):
+            self._revalidate(collectionID)
+
+        return collection
+
+    def _load_cached_data(self, collectionID: str) -> Dict:
+        "Not in memory yet or evicted, disk is the backing store, blocking"
+        collection, fetched = self.rankCache.get(self._cache_key(collectionID))
+        if collection is None:
+            return None
+
+        collection = self._compact(collection)
+        self.collectionsData[collectionID] = collection
+        self.fetched[collectionID] = fetched
+
+        if self.rankCache.is_stale(fetched):
+            self._revalidate(collectionID)
+
+        return collection
+
+    def _store_collection_data(self, collectionID: str, collection: Dict, fetched: float = None) -> Dict:
+        "Save downloaded collection obj to disk, returns its compact in memory form"
+        fetched = fetched if fetched is not None else time.time()
+
+        self.rankCache.set(self._cache_key(collectionID), collection, fetched)
+
+        collection = self._compact(collection)
+        self.collectionsData[collectionID] = collection
+        self.fetched[collectionID] = fetched
+
+        return collection
+
+    def _compact(self, collection: Dict) -> Dict:
+        return {**collection, "ranks": rarity.RankTable(collection["ranks"])}
+
+    def _revalidate(self, collectionID: str):
+        with self.lock:
+            if collectionID in self.revalidating:
+                return
+
+            self.revalidating.add(collectionID)
+
+        self._background(self._revalidate_worker, collectionID)
+
+    def _revalidate_worker(self, collectionID: str):
+        try:
+            # other process sharing the cache might have refreshed it already
+            collection, fetched = self.rankCache.get(self._cache_key(collectionID))
+
+            if collection is None or self.rankCache.is_stale(fetched):
+                self.flights.do(collectionID, self._download_collection_data, collectionID)
+            else:
+                self._store_collection_data(collectionID, collection, fetched)
+        except core_exceptions.CustomErr as e:
+            debug_print(e.what(), "RankPage")
+        except Exception as e:
+            debug_print(e, "RankPage")
+        finally:
+            with self.lock:
+                self.revalidating.discard(collectionID)
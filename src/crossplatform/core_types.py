@@ -1,9 +1,39 @@
 import enum
+import numpy as np
+
+
+def parse_traits(string: str) -> dict:
+    """
+    `Background:Red|Blue,Hat:Cap` -> {Background: [Red, Blue], Hat: [Cap]},
+    nft has to match one of the values of every listed trait type
+    """
+    result = {}
+
+    for group in string.split(','):
+        traitType, _, values = group.partition(':')
+        result[traitType.strip()] = [value.strip() for value in values.split('|')]
+
+    return result
+
+def trait_mask(wanted: dict, columns: dict) -> np.ndarray:
+    traits = columns["traits"] # matrix of trait codes, row per nft, -1 padded
+    table = columns["traitTable"]
+    mask = np.ones(len(traits), dtype=bool)
+
+    for traitType, values in wanted.items():
+        codes = [table.codes[(traitType, value)] for value in values if (traitType, value) in table.codes] if table else []
+        mask &= np.isin(traits, codes).any(axis=1)
+
+    return mask
+
 
 class NFTFilters(enum.Enum):
-    attributes = {"id": "atts", "func": lambda _: True} 
-    price = {"id": "price", "func": lambda max, value: float(max) >= float(value)}
-    rank = {"id": "rank", "func": lambda max, value: float(max) >= float(value)}
+    # id - column of the snapshot, parse - run once on the filter value, func(parsed value, columns) -> mask
+    attributes = {"id": "traits", "parse": parse_traits, "func": trait_mask}
+    price = {"id": "price", "parse": float, "func": lambda max, columns: columns["price"] <= max}
+    rank = {"id": "rank", "parse": float, "func": lambda max, columns: columns["rank"] <= max}
+    # percent of the collection floor, nothing passes while the floor is unknown (nan)
+    floor_pct = {"id": "floor", "parse": float, "func": lambda pct, columns: columns["price"] <= columns["floor"] * pct / 100}
 
 class MarketPageAPIs(enum.Enum):
     all_collections = 0
@@ -11,6 +41,7 @@ class MarketPageAPIs(enum.Enum):
     collection_info = 2
     snapshot_query = 3
     nft_querry = 4
+    feed_query = 5 # newest listings of several collections at once
 
 class RankPageAPIs(enum.Enum):
     all_collections = 0
@@ -1,23 +1,177 @@
+"""
+Logging of the bot
+------------------
+
+Callers only put records to a queue, a background thread formats and writes them,
+so logging costs no file I/O on the poll paths and the event loop.
+The log file rotates by size and age, repeats of the same message are
+suppressed for a while (429 storms) and summarised once the window passes.
+
+* debug_print \n
+    Function, log message of an origin (module/class name)
+* setup \n
+    Function, (re)configure level, file and console output
+"""
+
+import atexit
 import logging
+import logging.handlers
 import os
-import time
-import traceback
+import queue
 import sys
+import threading
+import time
+
+from typing import List
+
 
 LOG_PATH = "temp/log.txt"
-LOG_FILENAME = 'temp/logging_example.out'
+LOG_LEVEL = os.environ.get("UZZI_LOG_LEVEL", "INFO") # records under the level are dropped before formatting
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_MAX_AGE = 24 * 60 * 60 # seconds, the file is rotated at least this often
+LOG_BACKUPS = 5
+
+REPEAT_WINDOW = 60 # seconds
+REPEAT_LIMIT = 5 # same messages logged per window, the rest is counted and summarised
+
+logger = logging.getLogger("uzzi")
+listener = None
+
+
+class RotatingHandler(logging.handlers.RotatingFileHandler):
+    "Rotates once the file is over maxBytes or older than maxAge seconds"
+
+    def __init__(self, filename: str, maxBytes: int, maxAge: float, backupCount: int) -> None:
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding="utf-8", delay=True)
+        self.maxAge = maxAge
+        self.opened = time.time()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() - self.opened > self.maxAge:
+            return True
+
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.opened = time.time()
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Lets REPEAT_LIMIT records with the same origin and message through per window,
+    the first one after the window notes how many were dropped
+    """
+
+    def __init__(self, window: float = REPEAT_WINDOW, limit: int = REPEAT_LIMIT) -> None:
+        super().__init__()
+        self.window = window
+        self.limit = limit
+        self.seen = { } # dict [(logger, message), [window start, count]]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg)[:200])
+        now = record.created
+
+        with self.lock:
+            entry = self.seen.get(key)
+
+            if entry is not None and now - entry[0] <= self.window:
+                entry[1] += 1
+                return entry[1] <= self.limit
+
+            if len(self.seen) > 10000: # many distinct messages, forget the old windows
+                self.seen.clear()
+
+            self.seen[key] = [now, 1]
+
+        suppressed = entry[1] - self.limit if entry is not None else 0
+        if suppressed > 0:
+            record.msg = f"{record.msg} (repeated {suppressed} more times in the last {self.window}s)"
+
+        return True
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    "Hands the record over unformatted, the traceback is formatted by the writer thread"
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+
+def setup(level: str = LOG_LEVEL, path: str = LOG_PATH, console: bool = True):
+    global listener
+
+    if listener is not None:
+        listener.stop()
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+    fileHandler = RotatingHandler(path, LOG_MAX_BYTES, LOG_MAX_AGE, LOG_BACKUPS)
+    fileHandler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handlers: List[logging.Handler] = [fileHandler]
+
+    if console:
+        consoleHandler = logging.StreamHandler(sys.stdout)
+        consoleHandler.setFormatter(_ConsoleFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s", "%H:%M:%S"))
+        handlers.append(consoleHandler)
+
+    records = queue.SimpleQueue()
+    queueHandler = QueueHandler(records)
+    queueHandler.addFilter(RepeatFilter())
+
+    logger.handlers = [queueHandler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+
+def debug_print(msg: str, origin: str = "", level: int = None):
+    """
+    Log msg, tracebacks come from the exception being handled or from msg being an exception
+
+    level : int
+        logging level, ERROR when there is a traceback, INFO otherwise
+    """
+    excInfo = sys.exc_info()
+
+    if isinstance(msg, BaseException) and msg.__traceback__ is not None:
+        excInfo = (type(msg), msg, msg.__traceback__)
+
+    if excInfo[0] is None:
+        excInfo = None
+
+    if level is None:
+        level = logging.ERROR if excInfo else logging.INFO
+
+    if not logger.isEnabledFor(level):
+        return
+
+    (logger.getChild(origin) if origin else logger).log(level, msg, exc_info=excInfo)
+
+# private:
+class _ConsoleFormatter(logging.Formatter):
+    "One line per record, the tracebacks only go to the file"
 
-if not os.path.exists("temp"):
-    os.mkdir("temp")
+    def format(self, record: logging.LogRecord) -> str:
+        excText = record.exc_text # full traceback cached by the file handler
+        record.exc_text = None
 
-logging.basicConfig(filename=LOG_FILENAME, level=logging.DEBUG)
+        try:
+            return super().format(record)
+        finally:
+            record.exc_text = excText
 
-exc_type, exc_value, exc_traceback = sys.exc_info()
+    def formatException(self, excInfo) -> str:
+        return f"{excInfo[0].__name__}: {excInfo[1]}"
 
-def debug_print(msg: str, origin:str = ""):
-    with open(LOG_PATH, mode="a") as f:
-        tback = traceback.format_exc()
 
-        print(msg, tback)
-        logging.exception(msg)
-        f.write(f"{time.asctime()}, {origin}: {msg}; traceback: {tback} \n")
\ No newline at end of file
+setup()
+atexit.register(lambda: listener.stop() if listener is not None else None) # flush what is queued
@@ -0,0 +1,69 @@
+"""
+JSON decoding of page payloads
+------------------------------
+
+Uses orjson when it is installed and ijson for streaming the large catalogue
+documents, both fall back to the standard json module.
+
+* loads \n
+    Function, whole document with the fastest backend available
+* dumps \n
+    Function, value to json string
+* stream_values \n
+    Function, yields only the values at one path of a document read from a file like object
+"""
+
+import json
+
+from typing import Any, Iterator, List
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson # only catalogue downloads stream, the rest is small enough to decode whole
+except ImportError:
+    ijson = None
+
+
+def loads(data: bytes or str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+def dumps(value: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+
+    return json.dumps(value)
+
+def stream_values(source, path: str) -> Iterator[Any]:
+    """
+    Values at the path, ex. `collections.item.symbol` for the symbol of
+    every dict in the "collections" list (ijson prefix notation)
+
+    source : file like object
+        Read incrementally, only the values at the path are kept in memory
+    """
+    if ijson is not None:
+        yield from ijson.items(source, path)
+        return
+
+    yield from _walk(loads(source.read()), path.split('.') if path else [])
+
+# private:
+def _walk(value: Any, keys: List[str]) -> Iterator[Any]:
+    if not keys:
+        yield value
+        return
+
+    key, rest = keys[0], keys[1:]
+
+    if key == "item":
+        for item in value if isinstance(value, list) else []:
+            yield from _walk(item, rest)
+    elif isinstance(value, dict) and key in value:
+        yield from _walk(value[key], rest)
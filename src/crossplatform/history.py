@@ -0,0 +1,166 @@
+"""
+Recent listings and floor prices of the monitored collections
+-------------------------------------------------------------
+
+Fixed size numpy ring buffers, 16 bytes per listing and 8 per floor sample,
+allocated on the first record of a collection.
+
+* RingBuffer \n
+    Class, fixed capacity array overwriting its oldest rows
+* CollectionHistory \n
+    Class, listings (time, price, rank, token) and floor samples (time, floor) of one collection
+* History \n
+    Class, CollectionHistory per collection id
+"""
+
+import threading
+import time
+import numpy as np
+
+from typing import Iterable, Tuple
+
+
+LISTINGS = 64 # listings kept per collection
+FLOORS = 96 # floor samples kept per collection, a day at the default sampling interval
+
+LISTING = np.dtype([("time", np.uint32), ("price", np.float32), ("rank", np.int32), ("token", np.int32)])
+FLOOR = np.dtype([("time", np.uint32), ("floor", np.float32)])
+
+
+class RingBuffer:
+    def __init__(self, dtype: np.dtype, capacity: int) -> None:
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.next = 0 # index the next row goes to
+        self.full = False
+
+    def __len__(self) -> int:
+        return len(self.data) if self.full else self.next
+
+    def append(self, row: Tuple):
+        self.data[self.next] = row
+        self.next = (self.next + 1) % len(self.data)
+        self.full = self.full or self.next == 0
+
+    def view(self) -> np.ndarray:
+        "Rows oldest first, a copy once the buffer wrapped around"
+        if not self.full:
+            return self.data[:self.next]
+
+        return np.concatenate((self.data[self.next:], self.data[:self.next]))
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes
+
+
+class CollectionHistory:
+    def __init__(self, listings: int = LISTINGS, floors: int = FLOORS) -> None:
+        self.listings = RingBuffer(LISTING, listings)
+        self.floors = RingBuffer(FLOOR, floors)
+        self.lock = threading.Lock()
+
+    def add_listings(self, nfts: Iterable):
+        "core.NFT objects, time is the listing time when the page tells it, now otherwise"
+        now = time.time()
+
+        with self.lock:
+            for nft in nfts:
+                token = nft.name.split('#')[-1].strip()
+
+                self.listings.append((
+                    nft.listedAt if nft.listedAt is not None else now,
+                    nft.price,
+                    nft.rank if nft.rank is not None else -1,
+                    int(token) if token.isdigit() else -1,
+                ))
+
+    def add_floor(self, floor: float, at: float = None):
+        "Sample taken at the time of the latest one is skipped, cached floors come back until refreshed"
+        at = int(at if at is not None else time.time())
+
+        with self.lock:
+            if len(self.floors) and self.floors.data[self.floors.next - 1]["time"] == at:
+                return
+
+            self.floors.append((at, floor))
+
+    def recent(self, since: float = None, maxRank: int = None) -> np.ndarray:
+        "Listings (time, price, rank, token) since the time and ranked at most maxRank, oldest first"
+        with self.lock:
+            listings = self.listings.view()
+
+        mask = np.ones(len(listings), dtype=bool)
+
+        if since is not None:
+            mask &= listings["time"] >= since
+
+        if maxRank is not None:
+            mask &= (listings["rank"] > 0) & (listings["rank"] <= maxRank)
+
+        return listings[mask]
+
+    def cheapest(self, since: float = None, maxRank: int = None) -> np.void:
+        "Cheapest listing matching recent(), None when there is none"
+        listings = self.recent(since, maxRank)
+
+        return listings[np.argmin(listings["price"])] if len(listings) else None
+
+    def floor(self) -> float:
+        "Latest floor sample, None before the first one"
+        with self.lock:
+            if not len(self.floors):
+                return None
+
+            return float(self.floors.data[self.floors.next - 1]["floor"])
+
+    def rolling_floor(self, window: float = 60 * 60) -> float:
+        """
+        Mean of the floor samples in the last window seconds, the cheapest
+        listing of the window when no floor was sampled, None without either
+        """
+        since = time.time() - window
+
+        with self.lock:
+            floors = self.floors.view()
+
+        floors = floors[floors["time"] >= since]["floor"]
+        if len(floors):
+            return float(floors.mean())
+
+        cheapest = self.cheapest(since)
+        return float(cheapest["price"]) if cheapest is not None else None
+
+    def price_vs_floor(self, price: float, window: float = 60 * 60) -> float:
+        "price / rolling floor, 0.8 is 20 % under the floor, None without a floor"
+        floor = self.rolling_floor(window)
+
+        return price / floor if floor else None
+
+    @property
+    def nbytes(self) -> int:
+        return self.listings.nbytes + self.floors.nbytes
+
+
+class History:
+    def __init__(self, listings: int = LISTINGS, floors: int = FLOORS) -> None:
+        self.capacity = (listings, floors)
+        self.collections = { } # dict [collectionId, CollectionHistory]
+
+    def __contains__(self, collectionID: str) -> bool:
+        return collectionID in self.collections
+
+    def __getitem__(self, collectionID: str) -> CollectionHistory:
+        "History of the collection, created empty on first use"
+        history = self.collections.get(collectionID)
+
+        if history is None:
+            history = self.collections.setdefault(collectionID, CollectionHistory(*self.capacity))
+
+        return history
+
+    def remove(self, collectionID: str):
+        self.collections.pop(collectionID, None)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(history.nbytes for history in list(self.collections.values()))
@@ -0,0 +1,261 @@
+"""
+In memory metrics of the bot
+----------------------------
+
+Counters, gauges and histograms rendered in the Prometheus text format,
+served on a local http endpoint and summarised by the `.stats` command.
+
+* Counter, Gauge, Histogram \n
+    Classes, one named metric with optional labels
+* Registry \n
+    Class, all metrics of the process by name
+* endpoint \n
+    Function, url -> endpoint label with the collection ids left out
+* serve \n
+    Coroutine, local http endpoint with the rendered metrics
+"""
+
+import asyncio
+import bisect
+import threading
+
+from aiohttp import web
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+ENDPOINT_PARAMS = {"collections", "getCollectionEscrowStats", "item-details"} # path segments followed by an id
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+        self.values = { } # dict [label values, value]
+        self.lock = threading.Lock()
+
+    def remove(self, *labels):
+        with self.lock:
+            self.values.pop(self._key(labels), None)
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        "[(sample name, {label: value}, value)]"
+        with self.lock:
+            return [(self.name, self._labels(key), value) for key, value in self.values.items()]
+
+# private:
+    def _key(self, labels: Tuple) -> Tuple[str]:
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {labels}")
+
+        return tuple(str(label) for label in labels)
+
+    def _labels(self, key: Tuple[str]) -> Dict[str, str]:
+        return dict(zip(self.labels, key))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    Value set by the owner, or read from `collect` ({label values: value}) at render time
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str] = (), collect: Callable[[], Dict[Tuple, float]] = None) -> None:
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        if self.collect is None:
+            return super().samples()
+
+        return [(self.name, self._labels(self._key(key)), value) for key, value in self.collect().items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str] = (), buckets: Tuple[float] = BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0] # counts per bucket (+Inf last), sum, count
+
+            data[0][bisect.bisect_left(self.buckets, value)] += 1
+            data[1] += value
+            data[2] += 1
+
+    def count(self, *labels) -> int:
+        data = self.values.get(self._key(labels))
+        return data[2] if data else 0
+
+    def quantile(self, fraction: float, *labels) -> float:
+        "Upper bound of the bucket holding the quantile, None without observations"
+        data = self.values.get(self._key(labels))
+        if not data or not data[2]:
+            return None
+
+        rank = fraction * data[2]
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + (float("inf"),), data[0]):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+
+        return float("inf")
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        result = []
+
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                labels = self._labels(key)
+                cumulative = 0
+
+                for bound, bucketCount in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucketCount
+                    result.append((f"{self.name}_bucket", {**labels, "le": _number(bound)}, cumulative))
+
+                result.append((f"{self.name}_sum", labels, total))
+                result.append((f"{self.name}_count", labels, count))
+
+        return result
+
+
+class Registry:
+    """
+    Metrics by name, asking twice for the same name returns the same metric
+    """
+
+    def __init__(self) -> None:
+        self.metrics = { } # dict [name, Metric]
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Metric:
+        return self.metrics[name]
+
+    def counter(self, name: str, help: str, labels: Tuple[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str] = (), collect: Callable[[], Dict[Tuple, float]] = None) -> Gauge:
+        gauge = self._register(Gauge(name, help, labels, collect))
+
+        if collect is not None: # newest owner of the collected values wins
+            gauge.collect = collect
+
+        return gauge
+
+    def histogram(self, name: str, help: str, labels: Tuple[str] = (), buckets: Tuple[float] = BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        "Prometheus text exposition format"
+        lines = []
+
+        for metric in list(self.metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e: # a failing collector must not take the other metrics down
+                lines.append(f"# {metric.name} failed: {e}")
+                continue
+
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+
+            for name, labels, value in samples:
+                labelText = ','.join(f'{label}="{_escape(text)}"' for label, text in labels.items())
+                lines.append(f"{name}{{{labelText}}} {_number(value)}" if labelText else f"{name} {_number(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+# private:
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+
+def endpoint(url: str) -> str:
+    "host/path of the url, ids in the path replaced by {}, so every collection shares one label"
+    parts = urlsplit(url)
+    segments = parts.path.strip('/').split('/')
+
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ENDPOINT_PARAMS:
+            segments[i] = "{}"
+
+    return f"{parts.hostname}/{'/'.join(segments)}"
+
+async def serve(port: int, host: str = "127.0.0.1"):
+    "Serve registry.render() on http://host:port/metrics until cancelled"
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.add_routes([web.get("/metrics", handle)])
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+# private:
+def _escape(text: str) -> str:
+    return str(text).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value: float) -> str:
+    if value is None:
+        return "NaN"
+
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+registry = Registry()
+
+# shared metrics, modules record to them directly
+requestSeconds = registry.histogram("uzzi_request_seconds", "Latency of http requests", ("endpoint",))
+requestsTotal = registry.counter("uzzi_requests_total", "Http requests by response status, error when none came", ("endpoint", "status"))
+pollSeconds = registry.histogram("uzzi_poll_seconds", "Time to fetch the listings of one collection")
+collectionPollSeconds = registry.gauge("uzzi_collection_poll_seconds", "Duration of the last poll of the collection", ("collection",))
+diffListings = registry.histogram("uzzi_diff_listings", "New or cheaper listings found by one poll", buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+roundSeconds = registry.histogram("uzzi_round_seconds", "Duration of Monitor.update rounds and scheduling ticks")
+notificationLag = registry.histogram("uzzi_notification_lag_seconds", "Listing createdAt to the discord message",
+    buckets=(1, 2, 5, 10, 20, 30, 60, 120, 300, 600))
+notificationsTotal = registry.counter("uzzi_notifications_total", "Notifications sent to discord")
@@ -1,79 +1,803 @@
+import asyncio
+import aiohttp
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import random
 import requests
 import time
 import threading
 
-from typing import List
-from requests.auth import HTTPProxyAuth
+from typing import Any, Callable, List, Dict
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from crossplatform import core_exceptions, decoding, metrics
 from crossplatform.debug import debug_print
 
+try:
+    import brotli # only advertise br when we are able to decode it
+except ImportError:
+    brotli = None
 
-proxies = [] # list of ip addresses in strings 
-requestCount = 0
+
+ASYNC_TIMEOUT = 10
+TIMEOUT = ASYNC_TIMEOUT # seconds to connect and between received bytes, requests has no default
+POOL_HOSTS = 4 # distinct hosts kept per session (magiceden, howrare, ...)
+POOL_SIZE = 16 # max open connections per host, per session
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+
+RATE = 2.0 # starting requests per second, per host and proxy
+RATE_MIN = 0.05
+RATE_MAX = 20.0
+BURST = 10 # bucket capacity until the server tells us its limit
+RATE_WINDOW = 1 # seconds the X-RateLimit-Limit budget is for, the headers don't say
+RATE_STEP = 0.5 # requests per second added per success while probing a server without limit headers
+RATE_SHARE = 0.1 # fraction of X-RateLimit-Limit that X-RateLimit-Remaining may miss our tokens by before the budget counts as shared
+
+HOST_LIMITS = { # max requests in flight per host, over all proxies
+    "api-mainnet.magiceden.io": 32,
+    "howrare.is": 8,
+}
+
+
+class Proxy:
+    """
+    Proxy parsed once from `user:password@host:port` (credentials optional)
+    """
+
+    def __init__(self, address: str) -> None:
+        address = address.strip()
+        address = address.split("://", 1)[-1].rstrip('/')
+
+        credentials, _, location = address.rpartition('@')
+        username, _, password = credentials.partition(':')
+        host, _, port = location.partition(':')
+
+        self.host = host
+        self.port = int(port) if port else 80
+        self.username = username or None
+        self.password = password or None
+
+        self.url = f"http://{address}/" # with credentials, requests reads them for CONNECT too
+        self.address = f"http://{self.host}:{self.port}" # without credentials, for aiohttp
+        self.auth = aiohttp.BasicAuth(username, password or "") if username else None
+        self.requestsProxies = {"http": self.url, "https": self.url}
+
+    def __repr__(self) -> str:
+        return f"Proxy({self.host}:{self.port})"
+
+
+class SessionPool:
+    """
+    Long-lived keep-alive sessions, one per proxy (None is the direct connection)
+
+    Requests sessions are shared across threads, aiohttp sessions are created
+    per event loop because they can't outlive the loop they were made in.
+    """
+
+    def __init__(self, poolHosts: int = POOL_HOSTS, poolSize: int = POOL_SIZE) -> None:
+        self.poolHosts = poolHosts
+        self.poolSize = poolSize
+
+        self.sessions = { } # dict [proxy, requests session]
+        self.asyncSessions = { } # dict [(event loop, proxy), aiohttp session]
+        self.lock = threading.Lock()
+
+    def get(self, proxy: Proxy = None) -> requests.Session:
+        session = self.sessions.get(proxy)
+        if session is not None:
+            return session
+
+        with self.lock:
+            if proxy not in self.sessions:
+                self.sessions[proxy] = self._create_session(proxy)
+
+            return self.sessions[proxy]
+
+    def get_async(self, proxy: Proxy = None) -> aiohttp.ClientSession:
+        key = (asyncio.get_running_loop(), proxy)
+        session = self.asyncSessions.get(key)
+
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.poolSize * self.poolHosts, limit_per_host=self.poolSize)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"Accept-Encoding": ACCEPT_ENCODING},
+                timeout=aiohttp.ClientTimeout(total=ASYNC_TIMEOUT))
+            self.asyncSessions[key] = session
+
+        return session
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+
+            self.sessions = { }
+
+    def drop(self, proxy: Proxy):
+        "Close the sessions of a proxy that is not used anymore, aiohttp ones on their own loop"
+        with self.lock:
+            session = self.sessions.pop(proxy, None)
+
+        if session is not None:
+            session.close()
+
+        for key in [key for key in list(self.asyncSessions.keys()) if key[1] is proxy]:
+            loop, _ = key
+            session = self.asyncSessions.pop(key, None)
+
+            if session is not None and not session.closed and not loop.is_closed():
+                asyncio.run_coroutine_threadsafe(session.close(), loop)
+
+    async def close_async(self):
+        loop = asyncio.get_running_loop()
+
+        for key in [key for key in self.asyncSessions.keys() if key[0] is loop]:
+            session = self.asyncSessions.pop(key)
+
+            if not session.closed:
+                await session.close()
+
+# private:
+    def _create_session(self, proxy: Proxy) -> requests.Session:
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        # pool_block keeps the connection count per host bounded under many threads
+        adapter = HTTPAdapter(pool_connections=self.poolHosts, pool_maxsize=self.poolSize, pool_block=True)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        if proxy is not None:
+            session.proxies.update(proxy.requestsProxies)
+
+        return session
+
+
+class ProxyStats:
+    "Health of single proxy, latency and error rate are exponential moving averages"
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0 # 429 responses
+
+        self.latency = None # seconds
+        self.errorRate = 0.0
+        self.failStreak = 0
+
+        self.quarantines = 0 # consecutive quarantines, drives the cool-down
+        self.quarantinedUntil = 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttled": self.throttled,
+            "latency": self.latency,
+            "error_rate": self.errorRate,
+            "quarantined_for": max(0.0, self.quarantinedUntil - time.monotonic()),
+        }
+
+
+class ProxyManager:
+    """
+    Picks proxies weighted by their health instead of blind round robin
+
+    Every request reports back its latency and outcome, proxies that keep failing
+    or answer 5xx are quarantined with exponentially growing cool-down,
+    429s are left to the rate limiter.
+    Safe to use from multiple threads.
+
+    Parameters
+    ----------
+    cooldown : float
+        Quarantine length after the first offence, seconds
+    maxCooldown : float
+        Upper bound of the quarantine length, seconds
+    failLimit : int
+        Consecutive errors before the proxy is quarantined
+    alpha : float
+        Weight of the newest sample in the moving averages
+    """
+
+    def __init__(self, cooldown: float = 5, maxCooldown: float = 300, failLimit: int = 3, alpha: float = 0.2) -> None:
+        self.cooldown = cooldown
+        self.maxCooldown = maxCooldown
+        self.failLimit = failLimit
+        self.alpha = alpha
+
+        self.proxies = [] # list of Proxy objects
+        self.health = { } # dict [proxy, ProxyStats]
+        self.lock = threading.Lock()
+
+    def add(self, proxy: Proxy):
+        with self.lock:
+            self.proxies.append(proxy)
+            self.health[proxy] = ProxyStats()
+
+    def replace(self, proxies: List[Proxy]) -> List[Proxy]:
+        "Use exactly these proxies from now on, health of the ones already known is kept, returns the dropped ones"
+        with self.lock:
+            known = {proxy.url: proxy for proxy in self.proxies}
+            self.proxies[:] = [known.get(proxy.url, proxy) for proxy in proxies] # in place, module level `proxies` is this list
+            self.health = {proxy: self.health.get(proxy) or ProxyStats() for proxy in self.proxies}
+
+            kept = set(self.proxies)
+            return [proxy for proxy in known.values() if not proxy in kept]
+
+    def acquire(self) -> Proxy:
+        with self.lock:
+            if not len(self.proxies):
+                raise core_exceptions.NotInitialized("ProxyManager: no proxies loaded")
+
+            now = time.monotonic()
+            healthy = [proxy for proxy in self.proxies if self.health[proxy].quarantinedUntil <= now]
+
+            if not healthy: # everything is benched, use the one released the soonest
+                return min(self.proxies, key=lambda proxy: self.health[proxy].quarantinedUntil)
+
+            weights = [self._weight(self.health[proxy]) for proxy in healthy]
+
+        return random.choices(healthy, weights)[0]
+
+    def report(self, proxy: Proxy, latency: float, status: int = None, error: bool = False):
+        """
+        Record outcome of request, `error` is for requests that never got a response
+        """
+        throttled = status == 429 # its rate limiter bucket pauses, the proxy is not benched for it
+        failed = error or throttled or status is None or status >= 500 or status == 407
+
+        with self.lock:
+            stats = self.health.get(proxy)
+            if stats is None: # replaced while the request was in flight
+                return
+
+            stats.requests += 1
+
+            if not error:
+                stats.latency = latency if stats.latency is None else \
+                    (1 - self.alpha) * stats.latency + self.alpha * latency
+
+            stats.errorRate = (1 - self.alpha) * stats.errorRate + self.alpha * float(failed)
+
+            if not failed:
+                stats.failStreak = 0
+                stats.quarantines = 0
+                return
+
+            stats.errors += 1
+            stats.throttled += throttled
+
+            if throttled: # lowers its weight through errorRate only
+                return
+
+            stats.failStreak += 1
+
+            if stats.failStreak >= self.failLimit:
+                cooldown = min(self.maxCooldown, self.cooldown * 2 ** stats.quarantines)
+                stats.quarantinedUntil = time.monotonic() + cooldown
+                stats.quarantines += 1
+                stats.failStreak = 0
+
+    def stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {f"{proxy.host}:{proxy.port}": self.health[proxy].as_dict() for proxy in self.proxies}
+
+# private:
+    def _weight(self, stats: ProxyStats) -> float:
+        latency = stats.latency if stats.latency is not None else 0.1 # untried proxies get a fair chance
+        return max(0.01, 1 - stats.errorRate) / max(latency, 0.01)
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate and budget are learned from the server
+
+    `reserve` hands out the time a request may be sent at, so concurrent callers
+    are spaced out instead of all firing and tripping the limit together.
+    """
+
+    def __init__(self, rate: float = RATE, capacity: float = BURST) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blockedUntil = 0.0
+        self.peak = None # highest X-RateLimit-Remaining seen
+        self.shared = False # the server budget is spent by other buckets too
+
+    def reserve(self) -> float:
+        "Take a token, returns seconds to wait before using it"
+        now = time.monotonic()
+        self._refill(now)
+
+        self.tokens -= 1
+        waitTime = max(0.0, -self.tokens / self.rate, self.blockedUntil - now)
+
+        return waitTime
+
+    def update(self, status: int, headers: Dict):
+        """
+        With X-RateLimit-Limit the burst is the limit and the rate is the limit over its window,
+        X-RateLimit-Remaining caps the tokens. Remaining well below our own tokens means others
+        spend the same budget, the bucket is marked shared.
+        Retry-After is a pause, not a rate cut.
+        Without limit headers the rate is probed additively and cut by 429s that don't say how long to wait.
+        """
+        now = time.monotonic()
+        self._refill(now)
+
+        limit = _header_number(headers, "X-RateLimit-Limit")
+        remaining = _header_number(headers, "X-RateLimit-Remaining")
+        retryAfter = _header_number(headers, "Retry-After")
+
+        if limit:
+            self.capacity = limit
+        elif remaining is not None and (self.peak is None or remaining > self.peak):
+            self.peak = remaining # no limit header, the fullest we have seen the budget is the best guess
+            self.capacity = remaining + 1
+
+        if limit and remaining is not None and remaining < self.tokens - max(2, limit * RATE_SHARE):
+            self.shared = True # in flight requests only leave the server with more than we think, not less
+
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining) # never believe we have more than the server says
+
+        if limit:
+            self.rate = min(RATE_MAX, limit / RATE_WINDOW)
+
+        if status == 429:
+            self.tokens = min(self.tokens, 0)
+
+            if retryAfter:
+                self.blockedUntil = max(self.blockedUntil, now + retryAfter)
+            elif limit:
+                self.blockedUntil = max(self.blockedUntil, now + 1 / self.rate)
+            else: # nothing to go by
+                self.rate = max(RATE_MIN, self.rate * 0.75)
+                self.blockedUntil = max(self.blockedUntil, now + 1 / self.rate)
+        elif not limit:
+            self.rate = min(RATE_MAX, self.rate + RATE_STEP)
+
+# private:
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Token bucket per (host, proxy) pair, shared by all threads and coroutines
+
+    Hosts whose budget turns out to be shared by the proxies, the limit is not per IP
+    or the proxies leave through the same one, get a single bucket for all of them.
+    """
+
+    def __init__(self) -> None:
+        self.buckets = { } # dict [(host, proxy), TokenBucket]
+        self.pooled = set() # hosts with one bucket for all proxies
+        self.lock = threading.Lock()
+
+    def reserve(self, url: str, proxy: Proxy = None) -> float:
+        with self.lock:
+            return self._bucket(url, proxy).reserve()
+
+    def wait(self, url: str, proxy: Proxy = None):
+        waitTime = self.reserve(url, proxy)
+
+        if waitTime > 0:
+            time.sleep(waitTime)
+
+    async def async_wait(self, url: str, proxy: Proxy = None):
+        waitTime = self.reserve(url, proxy)
+
+        if waitTime > 0:
+            await asyncio.sleep(waitTime)
+
+    def observe(self, url: str, proxy: Proxy, response):
+        with self.lock:
+            bucket = self._bucket(url, proxy)
+            bucket.update(response.status_code, response.headers)
+
+            host = urlsplit(url).hostname
+            if bucket.shared and host not in self.pooled:
+                self.pooled.add(host)
+                for key in [key for key in self.buckets.keys() if key[0] == host and key[1] is not None]:
+                    self.buckets.pop(key)
+                self.buckets.setdefault((host, None), bucket)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                f"{host} via {proxy.host if proxy else 'direct'}": {"rate": bucket.rate, "tokens": bucket.tokens}
+                for (host, proxy), bucket in self.buckets.items()
+            }
+
+    def drop(self, proxy: Proxy):
+        "Forget the buckets of a proxy that is not used anymore"
+        with self.lock:
+            for key in [key for key in self.buckets.keys() if key[1] is proxy]:
+                self.buckets.pop(key)
+
+# private:
+    def _bucket(self, url: str, proxy: Proxy) -> TokenBucket:
+        host = urlsplit(url).hostname
+        key = (host, None if host in self.pooled else proxy)
+
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket()
+
+        return self.buckets[key]
+
+
+class HostLimiter:
+    """
+    Caps the requests in flight per host, hosts without a limit are not capped
+
+    Threads and coroutines of the event loop are capped separately, each by its own semaphore.
+    """
+
+    def __init__(self, limits: Dict[str, int] = None) -> None:
+        self.limits = dict(limits or {})
+        self.semaphores = { } # dict [host, threading.BoundedSemaphore]
+        self.asyncSemaphores = { } # dict [host, asyncio.Semaphore]
+
+        self.inFlight = collections.Counter()
+        self.waiting = collections.Counter()
+        self.lock = threading.Lock()
+
+    def set_limit(self, host: str, limit: int):
+        "New limit applies to requests started after the call"
+        with self.lock:
+            self.limits[host] = limit
+            self.semaphores.pop(host, None)
+            self.asyncSemaphores.pop(host, None)
+
+    @contextlib.contextmanager
+    def limit(self, url: str):
+        host = urlsplit(url).hostname
+        semaphore = self._semaphore(host, self.semaphores, threading.BoundedSemaphore)
+
+        if semaphore is None:
+            yield
+            return
+
+        self._count(host, waiting=1)
+        semaphore.acquire()
+        self._count(host, waiting=-1, inFlight=1)
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+            self._count(host, inFlight=-1)
+
+    @contextlib.asynccontextmanager
+    async def async_limit(self, url: str):
+        host = urlsplit(url).hostname
+        semaphore = self._semaphore(host, self.asyncSemaphores, asyncio.Semaphore)
+
+        if semaphore is None:
+            yield
+            return
+
+        self._count(host, waiting=1)
+        try:
+            await semaphore.acquire()
+        finally:
+            self._count(host, waiting=-1)
+
+        self._count(host, inFlight=1)
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+            self._count(host, inFlight=-1)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                host: {"limit": limit, "inFlight": self.inFlight[host], "waiting": self.waiting[host]}
+                for host, limit in self.limits.items()
+            }
+
+# private:
+    def _semaphore(self, host: str, semaphores: Dict, factory):
+        with self.lock:
+            if host not in self.limits:
+                return None
+
+            if host not in semaphores:
+                semaphores[host] = factory(self.limits[host])
+
+            return semaphores[host]
+
+    def _count(self, host: str, waiting: int = 0, inFlight: int = 0):
+        with self.lock:
+            self.waiting[host] += waiting
+            self.inFlight[host] += inFlight
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one, callers arriving
+    while it runs wait for it and share its result (or exception)
+
+    Threads join only calls made by threads, a coroutine joins calls made by
+    other coroutines and by threads too, so the event loop is never blocked.
+    """
+
+    def __init__(self) -> None:
+        self.calls = { } # dict [key, concurrent.futures.Future], calls running in threads
+        self.tasks = { } # dict [key, asyncio.Task], calls running in the event loop
+        self.lock = threading.Lock()
+
+        self.shared = 0 # calls served by a call of someone else
+
+    def do(self, key: Any, fn: Callable, *args) -> Any:
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = self.calls[key] = concurrent.futures.Future()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+
+        return result
+
+    async def async_do(self, key: Any, fn: Callable, *args) -> Any:
+        "fn is a coroutine function"
+        with self.lock:
+            future = self.calls.get(key)
+            task = self.tasks.get(key)
+
+            if future is not None or task is not None:
+                self.shared += 1
+
+        if future is not None: # thread is fetching it already
+            return await asyncio.wrap_future(future)
+
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+            self.tasks[key] = task
+
+        # shielded, one cancelled caller doesn't cancel the call the others wait for
+        return await asyncio.shield(task)
+
+
+def _header_number(headers: Dict, key: str) -> float:
+    value = headers.get(key)
+
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+sessionPool = SessionPool()
+rateLimiter = RateLimiter()
+hostLimiter = HostLimiter(HOST_LIMITS)
+proxyManager = ProxyManager()
+proxies = proxyManager.proxies # list of Proxy objects
+
+metrics.registry.gauge("uzzi_proxy_success_ratio", "Share of the requests through the proxy that succeeded", ("proxy",),
+    collect=lambda: {(address,): 1 - stats["errors"] / stats["requests"] for address, stats in proxyManager.stats().items() if stats["requests"]})
+metrics.registry.gauge("uzzi_proxy_quarantined_seconds", "Time until the benched proxy is used again", ("proxy",),
+    collect=lambda: {(address,): stats["quarantined_for"] for address, stats in proxyManager.stats().items()})
+metrics.registry.gauge("uzzi_host_in_flight", "Requests in flight per host", ("host",),
+    collect=lambda: {(host,): stats["inFlight"] for host, stats in hostLimiter.stats().items()})
+
+
+class AsyncResponse:
+    """
+    Already read aiohttp response, mimics the parts of requests.Response we use
+    """
+
+    def __init__(self, url: str, status: int, headers: Dict, content: bytes) -> None:
+        self.url = url
+        self.status_code = status
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return decoding.loads(self.content)
 
 
 def recursive_get(url: str, limit: int = 5, pause: float = 1, **kwargs) -> requests.Response:
-    response = requests.get(url, **kwargs)
+    response = fast_get(url, **kwargs)
     loopCount = 0
 
     while response.status_code != 200 and loopCount < limit: 
-        response = requests.get(url, **kwargs)
-        loopCount += 1
-
         time.sleep(pause)
 
+        response = fast_get(url, **kwargs)
+        loopCount += 1
+
     return response
 
 def safe_get(url: str, limit: int = 5, **kwargs) -> requests.Response:
+    """
+    Proxied get retried on 429, waiting is left to the rate limiter, whose
+    bucket of the throttled proxy is paused, the retry may pick another proxy
+    """
     response = proxy_get(url, **kwargs)
     loopCount = 0
     
-    while response.status_code != 200 and (response.status_code == 429 and loopCount >= limit):
-        print(f"{loopCount}: server returned code: {response.status_code}, trying again")
+    while response.status_code == 429 and loopCount < limit:
+        response.close() # streamed responses hold the connection until closed
         response = proxy_get(url, **kwargs)
-        
-        if response.status_code == 429:
-            waitTime = int(response.headers["Retry-After"])
-            waitTime = waitTime if waitTime else 1
-
-            for i in range(0, waitTime):
-                time.sleep(1)
-                
-                if not i % 15:
-                    print(f"{i}/{waitTime}")
-
         loopCount += 1
 
     if response.status_code != 200:
-        debug_print(f"finished with code: {response.status_code}, after: {loopCount} tries")
+        debug_print(f"finished with code: {response.status_code}, after: {loopCount} tries", "network", logging.WARNING)
 
     return response
 
 def proxy_get(url: str, **kwargs) -> requests.Response:
-    global proxies
-    global requestCount
+    proxy = proxyManager.acquire()
+    rateLimiter.wait(url, proxy)
+    startTime = time.monotonic()
 
-    proxyIndex = requestCount % len(proxies)
+    try:
+        response = _session_get(sessionPool.get(proxy), url, **kwargs)
+    except requests.RequestException:
+        proxyManager.report(proxy, time.monotonic() - startTime, error=True)
+        raise
 
-    with threading.Lock():
-        requestCount += 1
-    
-    # print("requesting ", url)
-    # print("  with proxy: ", proxies[proxyIndex]["http"])
+    proxyManager.report(proxy, time.monotonic() - startTime, response.status_code)
+    rateLimiter.observe(url, proxy, response)
 
-    return requests.get(url, proxies=proxies[proxyIndex], **kwargs)
+    return response
 
 def fast_get(url: str, **kwargs) -> requests.Response:
-    return requests.get(url, **kwargs)
+    rateLimiter.wait(url)
+    response = _session_get(sessionPool.get(), url, **kwargs)
+    rateLimiter.observe(url, None, response)
+
+    return response
+
+def stream_json(response: requests.Response, path: str) -> List:
+    """
+    Values at the path of the json body (see decoding.stream_values), decoded
+    while downloading, the request has to be made with stream=True
+    """
+    response.raw.decode_content = True # gzip/br decoded by urllib3
+
+    try:
+        return list(decoding.stream_values(response.raw, path))
+    finally:
+        response.close()
+
+async def close_async_session():
+    await sessionPool.close_async()
+
+async def async_request(url: str, proxy: Proxy = None, **kwargs) -> AsyncResponse:
+    session = sessionPool.get_async(proxy)
+
+    if proxy is not None:
+        kwargs["proxy"] = proxy.address
+        kwargs["proxy_auth"] = proxy.auth
+
+    async with hostLimiter.async_limit(url):
+        startTime = time.monotonic()
+
+        try:
+            async with session.get(url, **kwargs) as response:
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            _record(url, time.monotonic() - startTime, "error")
+            raise core_exceptions.NetworkError(f"{type(e).__name__} {e}, url: {url}")
+
+    _record(url, time.monotonic() - startTime, response.status)
+
+    return AsyncResponse(url, response.status, response.headers, content)
+
+async def async_recursive_get(url: str, limit: int = 5, pause: float = 1, **kwargs) -> AsyncResponse:
+    response = await async_fast_get(url, **kwargs)
+    loopCount = 0
+
+    while response.status_code != 200 and loopCount < limit:
+        await asyncio.sleep(pause)
+
+        response = await async_fast_get(url, **kwargs)
+        loopCount += 1
+
+    return response
+
+async def async_safe_get(url: str, limit: int = 5, **kwargs) -> AsyncResponse:
+    response = await async_proxy_get(url, **kwargs)
+    loopCount = 0
+
+    while response.status_code == 429 and loopCount < limit:
+        response = await async_proxy_get(url, **kwargs)
+        loopCount += 1
+
+    if response.status_code != 200:
+        debug_print(f"finished with code: {response.status_code}, after: {loopCount} tries", "network", logging.WARNING)
+
+    return response
+
+async def async_proxy_get(url: str, **kwargs) -> AsyncResponse:
+    proxy = proxyManager.acquire()
+    await rateLimiter.async_wait(url, proxy)
+    startTime = time.monotonic()
+
+    try:
+        response = await async_request(url, proxy=proxy, **kwargs)
+    except core_exceptions.NetworkError:
+        proxyManager.report(proxy, time.monotonic() - startTime, error=True)
+        raise
+
+    proxyManager.report(proxy, time.monotonic() - startTime, response.status_code)
+    rateLimiter.observe(url, proxy, response)
+
+    return response
+
+async def async_fast_get(url: str, **kwargs) -> AsyncResponse:
+    await rateLimiter.async_wait(url)
+    response = await async_request(url, **kwargs)
+    rateLimiter.observe(url, None, response)
+
+    return response
+
+def _session_get(session: requests.Session, url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", TIMEOUT) # hung host would hold the calling pool worker forever
+
+    with hostLimiter.limit(url):
+        startTime = time.monotonic()
+
+        try:
+            response = session.get(url, **kwargs)
+        except requests.RequestException:
+            _record(url, time.monotonic() - startTime, "error")
+            raise
+
+    _record(url, time.monotonic() - startTime, response.status_code)
+
+    return response
+
+def _record(url: str, latency: float, status):
+    endpoint = metrics.endpoint(url)
+
+    metrics.requestSeconds.observe(latency, endpoint)
+    metrics.requestsTotal.inc(endpoint, status)
 
 # TODO: check if the path is valid
-def load_proxies(file_path: str):
-    global proxies
-    global session
-        
+def read_proxies(file_path: str) -> List[str]:
+    "Proxy addresses in the file, one per line"
     with open(file_path, "r") as f:
-        for line in f.readlines():
-            data = line.replace('\n', '')
-            data = f"http://{data}/"
-            proxies.append({"http": data, "https": data})
+        return [line.replace('\n', '') for line in f.readlines() if line.strip()]
+
+def load_proxies(file_path: str):
+    for address in read_proxies(file_path):
+        proxyManager.add(Proxy(address))
 
-    # print(proxies)
+def replace_proxies(addresses: List[str]):
+    "Use exactly these proxies, sessions and rate limiter buckets of the dropped ones are released"
+    for proxy in proxyManager.replace([Proxy(address) for address in addresses]):
+        sessionPool.drop(proxy)
+        rateLimiter.drop(proxy)
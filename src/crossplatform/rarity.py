@@ -0,0 +1,229 @@
+"""
+Local trait index and rarity scoring
+------------------------------------
+
+* RankTable \n
+    Class, token -> rank of one collection, dense array for numeric tokens
+* TraitIndex \n
+    Class, inverted index trait -> bitset of tokens of one collection,
+    statistical rarity computed from the trait frequencies
+"""
+
+import threading
+import numpy as np
+
+import crossplatform.core as core # module import, core imports this module too
+from typing import List, Dict
+
+
+MIN_INDEXED = 100 # tokens, ranks among fewer seen tokens don't mean anything
+
+
+class RankTable:
+    """
+    Ranks of one collection
+
+    Numeric token ids (`#1234`) index a dense int32 array, 0 marks missing token,
+    other ids and numbers too sparse for the array go to a dict.
+    """
+
+    def __init__(self, ranks: Dict[str, int]) -> None:
+        numeric = {int(token): rank for token, rank in ranks.items() if str(token).isdigit()}
+        self.other = {str(token): rank for token, rank in ranks.items() if not str(token).isdigit()}
+
+        length = max(numeric.keys(), default=-1) + 1
+
+        if length > 4 * len(numeric) + 1024: # too sparse, a dict is smaller
+            self.other.update({str(token): rank for token, rank in numeric.items()})
+            numeric = { }
+            length = 0
+
+        self.dense = np.zeros(length, dtype=np.int32)
+        if numeric:
+            self.dense[np.fromiter(numeric.keys(), dtype=np.int64)] = np.fromiter(numeric.values(), dtype=np.int32)
+
+        self.count = len(numeric) + len(self.other)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, token: str) -> bool:
+        return self.get(token) is not None
+
+    def get(self, token: str) -> int:
+        if token.isdigit():
+            index = int(token)
+            if index < len(self.dense) and self.dense[index]:
+                return int(self.dense[index])
+
+        return self.other.get(token)
+
+    @property
+    def nbytes(self) -> int:
+        "Rough memory use, the dict part counted at ~100 bytes per entry"
+        return self.dense.nbytes + 100 * len(self.other)
+
+
+class TraitIndex:
+    """
+    Inverted index of one collection, built from howrare's full collection or from seen listings
+
+    Tokens are rows, every trait (type, value) code has a packed bitset of the rows
+    having it, so "trait X and Y under rank N" is a few bitwise ands.
+    Ranks are the page's when every token came with one, statistical rarity otherwise.
+    Scores and bitsets are rebuilt lazily after tokens are added, the bitsets only once queried.
+    """
+
+    def __init__(self) -> None:
+        self.table = core.TraitTable()
+        self.tokens = [] # row -> token id
+        self.rows = { } # dict [token id, row]
+        self.traits = [] # row -> tuple of trait codes
+        self.given = [] # row -> rank the page gave the token, None when unknown
+        self.complete = False # holds the whole collection, set by the builder
+        self.lock = threading.Lock()
+
+        self.dirty = True
+        self.scores = None # log of the statistical rarity, lower is rarer
+        self.ranks = None # row -> rank, 1 is the rarest
+        self.pageRanks = False # ranks are the page's, comparable with the rank column of snapshots
+        self.bitsets = None # matrix, packed row bitset per trait code, None until queried after a change
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self.rows
+
+    def add(self, token: str, attributes: List[Dict], rank: int = None):
+        "Attributes are [{trait_type: ..., value: ...}] or howrare like [{name: ..., value: ...}]"
+        attributes = [{"trait_type": att.get("trait_type", att.get("name")), "value": att["value"]} for att in attributes]
+
+        with self.lock:
+            if token in self.rows:
+                return
+
+            self.rows[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.traits.append(self.table.encode(attributes))
+            self.given.append(rank)
+            self.dirty = True
+            self.bitsets = None
+
+    def rank(self, token: str) -> int:
+        "Rank of the token, None while a partial index has fewer than MIN_INDEXED tokens"
+        if (len(self.tokens) < MIN_INDEXED and not self.complete) or not token in self.rows:
+            return None
+
+        self._build()
+        return int(self.ranks[self.rows[token]])
+
+    def score(self, token: str) -> float:
+        self._build()
+        return float(self.scores[self.rows[token]])
+
+    def query(self, traits: Dict[str, List[str]] = None, maxRank: float = None) -> List[str]:
+        """
+        Tokens matching one of the values of every trait type and ranked at most maxRank
+
+        traits : dict
+            {trait type: [values]}, same shape as core_types.parse_traits returns
+        """
+        bitsets = self._build_bitsets()
+        result = np.packbits(np.ones(len(self.tokens), dtype=bool))
+
+        for traitType, values in (traits or {}).items():
+            anyValue = np.zeros_like(result)
+
+            for value in values:
+                code = self.table.codes.get((traitType, value))
+                if code is not None and code < len(bitsets):
+                    anyValue |= bitsets[code]
+
+            result &= anyValue
+
+        if maxRank is not None:
+            self._build()
+            result &= np.packbits(self.ranks <= maxRank)
+
+        rows = np.flatnonzero(np.unpackbits(result, count=len(self.tokens)))
+
+        return [self.tokens[row] for row in rows]
+
+    def prepare(self):
+        "Compute the ranks and bitsets now, so the next queries don't"
+        self._build()
+        self._build_bitsets()
+
+    def count(self, traitType: str, value: str) -> int:
+        "Tokens having the trait"
+        bitsets = self._build_bitsets()
+        code = self.table.codes.get((traitType, value))
+
+        return int(np.unpackbits(bitsets[code]).sum()) if code is not None and code < len(bitsets) else 0
+
+# private:
+    def _build(self):
+        if not self.dirty:
+            return
+
+        with self.lock:
+            given = np.array([rank if rank is not None else 0 for rank in self.given], dtype=np.int64)
+            self.scores = self._statistical_rarity()
+
+            self.pageRanks = bool(len(given) and given.all())
+
+            if self.pageRanks: # the page ranked every token
+                self.ranks = given
+            else: # ties share the better rank
+                ordered = np.sort(self.scores)
+                self.ranks = np.searchsorted(ordered, self.scores, side="left") + 1
+
+            self.dirty = False
+
+    def _build_bitsets(self) -> np.ndarray:
+        bitsets = self.bitsets
+        if bitsets is not None:
+            return bitsets
+
+        with self.lock:
+            tokenCount = len(self.tokens)
+            rows, codes = self._flat_codes(tokenCount)
+
+            # presence matrix trait code x token, packed along the tokens
+            presence = np.zeros((len(self.table), tokenCount), dtype=bool)
+            presence[codes, rows] = True
+
+            bitsets = self.bitsets = np.packbits(presence, axis=1)
+
+        return bitsets
+
+    def _flat_codes(self, tokenCount: int):
+        "(row, code) pairs of the first tokenCount tokens as two arrays"
+        traits = self.traits[:tokenCount]
+        rows = np.repeat(np.arange(tokenCount), [len(codes) for codes in traits])
+        codes = np.fromiter((code for traitCodes in traits for code in traitCodes), dtype=np.int64, count=len(rows))
+
+        return rows, codes
+
+    def _statistical_rarity(self) -> np.ndarray:
+        """
+        Sum of log frequencies of the token's traits, trait types the token doesn't
+        have count as their own "none" trait
+        """
+        tokenCount = len(self.tokens)
+        rows, codes = self._flat_codes(tokenCount)
+
+        frequency = np.bincount(codes, minlength=len(self.table)) / max(tokenCount, 1)
+        scores = np.bincount(rows, weights=np.log(frequency[codes]), minlength=tokenCount)
+
+        # trait type of every code, how many tokens miss it
+        typeIds = { }
+        codeTypes = np.fromiter((typeIds.setdefault(traitType, len(typeIds)) for traitType, _ in self.table.pairs), dtype=np.int64, count=len(self.table))
+        hasType = np.zeros((tokenCount, len(typeIds)), dtype=bool)
+        hasType[rows, codeTypes[codes]] = True
+
+        missing = 1 - hasType.sum(axis=0) / max(tokenCount, 1)
+        logMissing = np.log(np.where(missing > 0, missing, 1))
+
+        return scores + (~hasType * logMissing).sum(axis=1)
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+import discord
+
+from discord import Embed, HTTPException
+from typing import Callable, List, Tuple
+
+from crossplatform import core, metrics
+from crossplatform.debug import debug_print
+from crossplatform.network import TokenBucket
+
+
+MAX_EMBEDS = 10 if discord.version_info.major >= 2 else 1  # embeds in one message, discord.py 1.x can send only one
+
+
+class Dispatcher:
+    """
+    Sends notifications the Monitor puts to the queue, independent of polling
+
+    Notifications waiting in the queue are coalesced, up to 10 embeds go out
+    in one message and messages are paced to the channel's rate limit bucket.
+
+    Parameters
+    ----------
+    render : Callable
+        Builds embed from (collectionID, nft)
+    queue : asyncio.Queue
+        Queue of (collectionID, nft) tuples, the Monitor's notification queue
+    coalesce : float
+        Seconds to wait for more notifications after the first one of a burst
+    rate, burst : float
+        Messages per second and burst size allowed in the channel (discord allows 5 per 5 s)
+    """
+
+    def __init__(self, render: Callable[[str, core.NFT], Embed], queue: asyncio.Queue, coalesce: float = 0.5, rate: float = 1, burst: float = 5, content: str = None) -> None:
+        self.render = render
+        self.queue = queue
+        self.coalesce = coalesce
+        self.content = content  # text sent with every message, ex. @everyone
+
+        self.bucket = TokenBucket(rate, burst)
+        self.sent = 0
+
+    async def run(self, channel):
+        while True:
+            batch = await self._next_batch()
+
+            for start in range(0, len(batch), MAX_EMBEDS):
+                try:
+                    chunk = batch[start:start + MAX_EMBEDS]
+                    await self._send(channel, [self.render(collectionID, nft) for collectionID, nft in chunk])
+                    self._observe(chunk)
+                except Exception as e:  # never let one bad message stop the delivery
+                    debug_print(e, "Dispatcher")
+
+# private:
+    async def _next_batch(self) -> List[Tuple[str, core.NFT]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.coalesce
+
+        while len(batch) < MAX_EMBEDS * 5:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _send(self, channel, embeds: List[Embed]):
+        waitTime = self.bucket.reserve()
+        if waitTime > 0:
+            await asyncio.sleep(waitTime)
+
+        try:
+            await self._post(channel, embeds)
+        except HTTPException as e:
+            if e.status != 429:
+                raise
+
+            # bucket shared with other traffic ran dry, back off and retry once
+            self.bucket.update(429, e.response.headers)
+            await asyncio.sleep(float(e.response.headers.get("Retry-After", 1)))
+            await self._post(channel, embeds)
+
+    def _observe(self, sent: List[Tuple[str, core.NFT]]):
+        now = time.time()
+        metrics.notificationsTotal.inc(amount=len(sent))
+
+        for _, nft in sent:
+            if nft.listedAt is not None:
+                metrics.notificationLag.observe(now - nft.listedAt)
+
+    async def _post(self, channel, embeds: List[Embed]):
+        if MAX_EMBEDS > 1:
+            await channel.send(content=self.content, embeds=embeds)
+        else:
+            await channel.send(content=self.content, embed=embeds[0])
+
+        self.sent += len(embeds)
@@ -1,6 +1,9 @@
-from typing import Dict, List
+import asyncio
+import datetime
 
-from crossplatform import core, core_exceptions, network
+from typing import Dict, List, Tuple
+
+from crossplatform import core, core_exceptions, decoding, network
 from crossplatform.core_types import MarketPageAPIs, RankPageAPIs
 
 
@@ -11,33 +14,113 @@ headers = {
     'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/99.0.4844.51 Safari/537.36',
 }
 
+MAGICEDEN_URL = "https://magiceden.io/marketplace/"
+MAGICEDEN_API = "https://api-mainnet.magiceden.io" # base of the api urls, a local stand-in can take its place
+HOWRARE_API = "https://howrare.is"
+
+LAMPORTS = 1e9 # in one SOL, escrow stats are in lamports
+
+SNAPSHOT_PAGE = 2 # listings in the first page, enough for quiet collections
+SNAPSHOT_PAGE_MAX = 20 # pages double up to this size while the collection is busy
+SNAPSHOT_DEPTH = 100 # never page further than this many listings in one poll
+
+FEED_COLLECTIONS = 50 # collections in one feed query, keeps the url short
+FEED_PAGE = 20 # listings in one page of the feed
+FEED_DEPTH = 200 # never page further than this many listings of one feed query
+FEED_COLLECTION = "collectionName" # symbol of the listing's collection
+
+
+def parse_time(createdAt: str) -> float:
+    "Api time (2022-03-10T12:00:00.000Z) to unix time, None when missing or malformed"
+    try:
+        return datetime.datetime.fromisoformat(createdAt.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
 class Magiceden(core.MarketPage): 
-    def __init__(self) -> None:
+    def __init__(self, api: str = MAGICEDEN_API, url: str = MAGICEDEN_URL, rankPage: core.RankPage = None) -> None:
         super().__init__(
-            "https://magiceden.io/marketplace/", # url 
+            url, # url 
             {
-                MarketPageAPIs.all_collections: lambda: "https://api-mainnet.magiceden.io/all_collections?edge_cache=true",
-                MarketPageAPIs.collection_floor: lambda collection: f"https://api-mainnet.magiceden.io/rpc/getCollectionEscrowStats/{collection}?edge_cache=true",
-                MarketPageAPIs.collection_info: lambda collection: f"https://api-mainnet.magiceden.io/collections/{collection}?edge_cache=true",
-                MarketPageAPIs.snapshot_query: lambda collection: 'https://api-mainnet.magiceden.io/rpc/getListedNFTsByQuery?q={"$match":{"collectionSymbol":"' + collection + '"},"$sort":{"createdAt":-1},"$skip":0,"$limit":2}',
-                MarketPageAPIs.nft_querry: lambda nftId: f"https://magiceden.io/item-details/{nftId}"
+                MarketPageAPIs.all_collections: lambda: f"{api}/all_collections?edge_cache=true",
+                MarketPageAPIs.collection_floor: lambda collection: f"{api}/rpc/getCollectionEscrowStats/{collection}?edge_cache=true",
+                MarketPageAPIs.collection_info: lambda collection: f"{api}/collections/{collection}?edge_cache=true",
+                MarketPageAPIs.snapshot_query: lambda collection, skip=0, limit=SNAPSHOT_PAGE: api + '/rpc/getListedNFTsByQuery?q={"$match":{"collectionSymbol":"' + collection + '"},"$sort":{"createdAt":-1},"$skip":' + str(skip) + ',"$limit":' + str(limit) + '}',
+                MarketPageAPIs.nft_querry: lambda nftId: f"https://magiceden.io/item-details/{nftId}",
+                MarketPageAPIs.feed_query: lambda collections, skip=0, limit=FEED_PAGE: api + '/rpc/getListedNFTsByQuery?q={"$match":{"collectionSymbol":{"$in":' + decoding.dumps(collections) + '}},"$sort":{"createdAt":-1},"$skip":' + str(skip) + ',"$limit":' + str(limit) + '}',
             } # apis  
             )
 
-        self.rankPage = Howrare()
+        self.rankPage = rankPage if rankPage is not None else Howrare()
+        self.newestSeen = { } # dict [collectionId, createdAt of the newest listing seen]
 
     def get_snapshot(self, collectionID: str, rankID: str) -> core.Snapshot:
         if not self._check_collection(collectionID):
             raise Exception("Not valid collection")
 
-        # get collection data from internet
-        url = self.apis[MarketPageAPIs.snapshot_query](collectionID)
-        response = network.safe_get(url, headers=headers)
+        data = self.fetch_listings(collectionID)
+        snapshot = self.rank_listings(collectionID, rankID, data)
 
-        if response.status_code != 200 and (response.status_code > 399 or response.status_code < 300):
-            raise core_exceptions.NetworkError(f"Couldn't reach collection, code: {response.status_code}, url: {url}")
+        return self.diff_listings(collectionID, data, snapshot)
+
+    async def async_get_snapshot(self, collectionID: str, rankID: str) -> core.Snapshot:
+        if not self._check_collection(collectionID, wait=False):
+            raise Exception("Not valid collection")
+
+        data = await self.async_fetch_listings(collectionID)
+        snapshot = await self.async_rank_listings(collectionID, rankID, data)
+
+        return self.diff_listings(collectionID, data, snapshot)
+
+    def fetch_listings(self, collectionID: str) -> List[Dict]:
+        # get collection data from internet, page deeper only until we reach listings seen last time
+        skip, limit = (0, SNAPSHOT_PAGE)
+        data = []
+
+        while True:
+            url = self.apis[MarketPageAPIs.snapshot_query](collectionID, skip, limit)
+            page = self._read_page(url, network.safe_get(url, headers=headers))
+            data += page
+
+            if not self._needs_next_page(collectionID, page, skip, limit):
+                break
+
+            skip, limit = (skip + limit, min(limit * 2, SNAPSHOT_PAGE_MAX))
+
+        return data
+
+    async def async_fetch_listings(self, collectionID: str) -> List[Dict]:
+        skip, limit = (0, SNAPSHOT_PAGE)
+        data = []
+
+        while True:
+            url = self.apis[MarketPageAPIs.snapshot_query](collectionID, skip, limit)
+            page = self._read_page(url, await network.async_safe_get(url, headers=headers))
+            data += page
 
-        data = response.json()["results"]
+            if not self._needs_next_page(collectionID, page, skip, limit):
+                break
+
+            skip, limit = (skip + limit, min(limit * 2, SNAPSHOT_PAGE_MAX))
+
+        return data
+
+    def rank_listings(self, collectionID: str, rankID: str, data: List[Dict], rankData: Dict = None) -> core.Snapshot:
+        """
+        Raw listings to ranked Snapshot
+
+        rankData : dict
+            Rank page data of the collection, async_rank_listings passes the one it awaited,
+            looked up (blocking) when None
+        """
+        traitTable = self.get_trait_table(collectionID)
+
+        if rankData is None and rankID in self.rankPage.collections:
+            rankData = self.rankPage.get_collection_data(rankID)
+
+        if rankData is None: # no howrare ranks, rarity from the listings we have seen
+            self.rankPage.index_listings(rankID, [(nftDict["title"], nftDict["attributes"]) for nftDict in data])
 
         nfts = list(map(
             lambda nftDict : 
@@ -48,54 +131,183 @@ class Magiceden(core.MarketPage):
                 nftDict["price"],
                 nftDict["img"],
                 # nft_dict["rarity"],
-                self.rankPage.get_rank(rankID, nftDict["title"]),
-                nftDict["attributes"]
+                self.rankPage.get_rank(rankData if rankData is not None else rankID, nftDict["title"]),
+                nftDict["attributes"],
+                traitTable,
+                parse_time(nftDict.get("createdAt"))
             ), 
             data
         ))
 
-        newSnap = core.Snapshot(nfts)
+        return core.Snapshot(nfts)
+
+    async def async_rank_listings(self, collectionID: str, rankID: str, data: List[Dict]) -> core.Snapshot:
+        # ranks are parsed from the awaited data, the loop never waits for the catalogue or a download
+        rankData = None
+        if rankID in self.rankPage.get_collections(wait=False):
+            rankData = await self.rankPage.async_get_collection_data(rankID)
+
+        return self.rank_listings(collectionID, rankID, data, rankData)
+
+    def diff_listings(self, collectionID: str, data: List[Dict], newSnap: core.Snapshot) -> core.Snapshot:
+        "Listings new or cheaper since the last call for the collection"
+        newestSeen = self.newestSeen.get(collectionID)
+        createdAts = [nftDict["createdAt"] for nftDict in data if nftDict.get("createdAt") is not None]
+
+        if createdAts:
+            self.newestSeen[collectionID] = max(createdAts + [newestSeen or ""])
+
         lastSnap = self.lastSnap[collectionID] if collectionID in self.lastSnap.keys() else newSnap
-        result = newSnap - lastSnap
+
+        # deeper pages reach listings older than the last poll which just weren't in its window
+        olderIds = {nftDict["id"] for nftDict in data 
+            if newestSeen is not None and nftDict.get("createdAt") is not None and nftDict["createdAt"] <= newestSeen and not nftDict["id"] in lastSnap}
+        comparedSnap = core.Snapshot([nft for nft in newSnap.list if not nft.id in olderIds]) if olderIds else newSnap
+
+        result = comparedSnap - lastSnap
         
         self.lastSnap[collectionID] = newSnap
 
         return result
 
+    async def async_fetch_feed(self, collectionIDs: List[str]) -> Dict[str, List[Dict]]:
+        """
+        Newest listings of all the collections, FEED_COLLECTIONS per query sorted by createdAt,
+        {collectionID: listings} with only the collections that had some in the feed
+
+        Collections missing in the feed are marked seen down to the oldest listing of
+        their query, older listings coming back to it later are not taken for new ones
+        """
+        chunks = [collectionIDs[start:start + FEED_COLLECTIONS] for start in range(0, len(collectionIDs), FEED_COLLECTIONS)]
+        result = { }
+
+        for listings in await asyncio.gather(*[self._async_fetch_feed_chunk(chunk) for chunk in chunks]):
+            result.update(listings)
+
+        return result
+
+    async def async_get_floor(self, collectionID: str) -> float:
+        "Floor price in SOL, None when nothing is listed"
+        url = self.apis[MarketPageAPIs.collection_floor](collectionID)
+        response = await network.async_safe_get(url, headers=headers)
+
+        if response.status_code != 200:
+            raise core_exceptions.NetworkError(f"Couldn't reach collection floor, code: {response.status_code}, url: {url}")
+
+        floorPrice = decoding.loads(response.content)["results"].get("floorPrice")
+
+        return floorPrice / LAMPORTS if floorPrice else None
+
 # private:
+    def _read_page(self, url: str, response) -> List[Dict]:
+        if response.status_code != 200 and (response.status_code > 399 or response.status_code < 300):
+            raise core_exceptions.NetworkError(f"Couldn't reach collection, code: {response.status_code}, url: {url}")
+
+        return decoding.loads(response.content)["results"]
+
+    def _needs_next_page(self, collectionID: str, page: List[Dict], skip: int, limit: int) -> bool:
+        """
+        Page is full of listings newer than anything from the last poll, more might be hidden behind it
+        """
+        if not collectionID in self.lastSnap.keys(): # first poll, nothing to catch up with
+            return False
+
+        if len(page) < limit or skip + limit >= SNAPSHOT_DEPTH:
+            return False
+
+        lastSnap = self.lastSnap[collectionID]
+        newestSeen = self.newestSeen.get(collectionID)
+
+        for nftDict in page:
+            if nftDict["id"] in lastSnap:
+                return False
+
+            createdAt = nftDict.get("createdAt")
+            if newestSeen is not None and createdAt is not None and createdAt <= newestSeen:
+                return False
+
+        return True
+
+    async def _async_fetch_feed_chunk(self, collectionIDs: List[str]) -> Dict[str, List[Dict]]:
+        skip = 0
+        data = []
+
+        while True:
+            url = self.apis[MarketPageAPIs.feed_query](collectionIDs, skip, FEED_PAGE)
+            page = self._read_page(url, await network.async_safe_get(url, headers=headers))
+            data += page
+
+            if not self._feed_needs_next_page(collectionIDs, page, skip):
+                break
+
+            skip += FEED_PAGE
+
+        result = { }
+        for nftDict in data:
+            result.setdefault(nftDict.get(FEED_COLLECTION), []).append(nftDict)
+
+        # everything newer than the oldest listing in the feed was in it
+        oldest = min((nftDict["createdAt"] for nftDict in data if nftDict.get("createdAt") is not None), default=None)
+
+        for collectionID in collectionIDs:
+            if collectionID in result:
+                continue
+
+            self.lastSnap.setdefault(collectionID, core.Snapshot([])) # empty baseline, its next listing is new
+            if oldest is not None:
+                self.newestSeen[collectionID] = max(oldest, self.newestSeen.get(collectionID) or "")
+
+        return {collectionID: listings for collectionID, listings in result.items() if collectionID in collectionIDs}
+
+    def _feed_needs_next_page(self, collectionIDs: List[str], page: List[Dict], skip: int) -> bool:
+        """
+        Page is full of listings newer than the last read of the query, 
+        the newest listing any of its collections has seen is where that read started
+        """
+        if len(page) < FEED_PAGE or skip + FEED_PAGE >= FEED_DEPTH:
+            return False
+
+        seen = [self.newestSeen[collectionID] for collectionID in collectionIDs if self.newestSeen.get(collectionID) is not None]
+        if not seen: # first read, nothing to catch up with
+            return False
+
+        createdAts = [nftDict["createdAt"] for nftDict in page if nftDict.get("createdAt") is not None]
+
+        return bool(createdAts) and min(createdAts) > max(seen)
+
     def _parse_collections(self) -> List[str]:
         url = self.apis[MarketPageAPIs.all_collections]()
-        response = network.safe_get(url, headers=headers)
+        response = network.safe_get(url, headers=headers, stream=True)
 
         if response.status_code != 200 and (response.status_code > 399 or response.status_code < 300) :
+            response.close()
             raise core_exceptions.NetworkError(f"Couldn't reach all market collections, code: {response.status_code}, url: {url}")
 
-        data = response.json()["collections"] # list of dictionaries
-        collections = list(map(lambda collectionDict: collectionDict["symbol"] , data))
-
-        return collections
+        # only the symbols are decoded, not the whole multi-megabyte catalogue
+        return network.stream_json(response, "collections.item.symbol")
 
 class Howrare(core.RankPage): 
-    def __init__(self) -> None:
+    def __init__(self, api: str = HOWRARE_API) -> None:
         super().__init__(
-            "https://howrare.is/", # url
+            f"{api}/", # url
             {
-                RankPageAPIs.all_collections: lambda: "https://howrare.is/api/v0.1/collections",
-                RankPageAPIs.collection_full: lambda collection: f"https://howrare.is/api/v0.1/collections/{collection}",
-                RankPageAPIs.collection_rate: lambda collection: f"https://howrare.is/api/v0.1/collections/{collection}/only_rarity"
+                RankPageAPIs.all_collections: lambda: f"{api}/api/v0.1/collections",
+                RankPageAPIs.collection_full: lambda collection: f"{api}/api/v0.1/collections/{collection}",
+                RankPageAPIs.collection_rate: lambda collection: f"{api}/api/v0.1/collections/{collection}/only_rarity"
             } #apis
             )
 
 # private: 
     def _parse_collections(self) -> List[str]:
         url = self.apis[RankPageAPIs.all_collections]()
-        response = network.fast_get(url)
+        response = network.fast_get(url, stream=True)
 
         if response.status_code != 200:
+            response.close()
             raise core_exceptions.NetworkError(f"Couldn't reach all rank collections, code: {response.status_code}, url: {url}")
 
-        data = response.json()["result"]["data"] # list of dictionaries
-        collections = list(map(lambda collectionDict: collectionDict["url"][1:].lower() , data))
+        links = network.stream_json(response, "result.data.item.url")
+        collections = list(map(lambda link: link[1:].lower(), links))
 
         return collections
 
@@ -107,7 +319,33 @@ class Howrare(core.RankPage):
         if response.status_code != 200:
             raise core_exceptions.NetworkError("Howrare collection request failed")
 
-        data = response.json()["result"]["data"]
+        return self._decode_collection_data(collectionID, response.content)
+
+    async def _async_get_collection_data(self, collectionID: str) -> dict:
+        url = self.apis[RankPageAPIs.collection_rate](collectionID)
+        response = await network.async_fast_get(url)
+
+        if response.status_code != 200:
+            raise core_exceptions.NetworkError("Howrare collection request failed")
+
+        return await self._run(self._decode_collection_data, collectionID, response.content)
+
+    def _decode_collection_data(self, collectionID: str, content: bytes) -> dict:
+        return self._parse_collection_data(collectionID, decoding.loads(content))
+
+    def _get_collection_items(self, collectionID: str) -> List[Tuple[str, List[Dict], int]]:
+        url = self.apis[RankPageAPIs.collection_full](collectionID)
+        response = network.fast_get(url)
+
+        if response.status_code != 200:
+            raise core_exceptions.NetworkError(f"Howrare full collection request failed, code: {response.status_code}, url: {url}")
+
+        items = decoding.loads(response.content)["result"]["data"]["items"]
+
+        return [(nftDict["link"].split('/')[-1], nftDict.get("attributes", []), nftDict.get("rank")) for nftDict in items]
+
+    def _parse_collection_data(self, collectionID: str, payload: dict) -> dict:
+        data = payload["result"]["data"]
 
         ranks = {nftDict["link"].split('/')[-1] : nftDict["rank"] for nftDict in data["items"]} # extract id: rank dict from collection data
 
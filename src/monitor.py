@@ -1,9 +1,14 @@
 import asyncio
 import collections
+import heapq
+import itertools
+import logging
 import meden
+import numpy as np
 import time
-from concurrent.futures import ThreadPoolExecutor
-from crossplatform import core, core_types, network
+from pooling import WorkerPool
+from crossplatform import core, core_types, metrics, network, rarity
+from crossplatform.history import History
 from crossplatform import core_exceptions as errors
 
 # debug imports
@@ -12,6 +17,13 @@ from crossplatform.debug import debug_print
 
 
 
+RANK_WORKERS = 4  # rank stage mostly waits on cached tables, few workers are enough
+FETCH_PER_PROXY = 2  # fetch workers per proxy, each proxy keeps a couple of requests in flight
+FETCH_MIN = 8
+POOL_WORKERS = 8  # threads for blocking work, rank revalidation and catalogue refreshes
+FLOOR_INTERVAL = 15 * 60  # seconds between floor samples of one collection
+
+
 def parse_kwargs(args) -> dict:
     kwargs = {}
 
@@ -24,20 +36,76 @@ def parse_kwargs(args) -> dict:
 
     return kwargs
 
+def read_collections(filePath: str) -> List[Tuple[str, str, Dict[str, str]]]:
+    "[(collectionID, rankID, filters)] of the collections file, `;` comments the line out"
+    result = []
+
+    with open(filePath, 'r') as f:
+        for rawLine in f.readlines():
+            if rawLine[0] == ';':
+                continue
+
+            rawLine = rawLine.replace('\n', '')
+            ids, kwargs = rawLine.split(', ')
+            ids = ids.split(' ')
+            kwargs = kwargs.split(' ')
+
+            collectionID = ids[0]
+            rankID = ids[1] if len(ids) == 2 else collectionID.replace('_', '')
+
+            result.append((collectionID, rankID, parse_kwargs(kwargs)))
+
+    return result
+
 
 class FilterData:
     def __init__(self, **kwargs):
         result = {}
+        self.parsed = {}  # dict [snapshot column, parsed filter value]
+        self.matching = (None, None)  # (index, tokens it matched), filters and full indexes don't change
 
         for key, value in kwargs.items():
-            if key in core_types.NFTFilters.__dict__.keys():
-                filter_dict = core_types.NFTFilters.__dict__[key].value
-                result[filter_dict["id"]] = lambda nftValue, _value=value: (
-                    filter_dict["func"])(_value, nftValue)
-                # id of the attribute in NFT class
-                # function for checking the value
+            if key in core_types.NFTFilters.__members__.keys():
+                filter_dict = core_types.NFTFilters[key].value
+                parsed = filter_dict["parse"](value)  # parsed once, not on every check
+                self.parsed[filter_dict["id"]] = parsed
+                result[filter_dict["id"]] = lambda columns, _value=parsed, _func=filter_dict["func"]: _func(_value, columns)
+                # id of the column in Snapshot.columns
+                # function returning mask of the valid nfts
+
+        self.data = result  # dict of "snapshot_column": "filter_func"(columns)
+
+    @property
+    def needsFloor(self) -> bool:
+        return "floor" in self.data
+
+    def mask(self, snapshot: core.Snapshot, floor: float = None, index: rarity.TraitIndex = None) -> np.ndarray:
+        """
+        index : rarity.TraitIndex
+            Full trait index of the collection, the attributes (and rank) filters become
+            one index query instead of scanning the trait codes of every listing
+        """
+        columns = snapshot.columns()
+        mask = np.ones(len(snapshot), dtype=bool)
+        done = ()
+
+        if self.needsFloor:  # snapshot columns are cached, the floor goes to a copy
+            columns = {**columns, "floor": floor if floor is not None else np.nan}
 
-        self.data = result  # dict of "nft_att": "filter_func"(value)
+        if index is not None and "traits" in self.parsed:
+            done = ("traits", "rank") if index.pageRanks else ("traits",)
+
+            if self.matching[0] is not index:
+                self.matching = (index, set(index.query(self.parsed["traits"], self.parsed.get("rank") if "rank" in done else None)))
+
+            matching = self.matching[1]
+            mask &= np.fromiter((nft.name.split('#')[-1] in matching for nft in snapshot.list), dtype=bool, count=len(snapshot))
+
+        for column, filter_func in self.data.items():
+            if not column in done:
+                mask &= filter_func(columns)
+
+        return mask
 
 
 class CollectionData:
@@ -48,61 +116,506 @@ class CollectionData:
 
         self.lastSnapshot = core.Snapshot([], [])
 
-    def filter_snapshot(self, snapshot: core.Snapshot) -> core.Snapshot:
+    def filter_snapshot(self, snapshot: core.Snapshot, floor: float = None, index: rarity.TraitIndex = None) -> core.Snapshot:
+        if snapshot.isEmpty() or not self.filterData.data:
+            return snapshot
+
+        return snapshot.select(self.filterData.mask(snapshot, floor, index))
+
+    def update_snapshot(self, newSnapshot: core.Snapshot, floor: float = None, index: rarity.TraitIndex = None) -> core.Snapshot:
+        self.lastSnapshot = self.filter_snapshot(newSnapshot, floor, index)
+        return self.lastSnapshot
+
+
+class Scheduler:
+    """
+    Priority queue of collections ordered by the time of their next poll
+
+    Every collection gets its own interval, adapted to how fast it lists
+    (moving average of new listings per second), kept within min/max bounds.
+    Busy collections are polled often, quiet ones rarely.
+
+    Parameters
+    ----------
+    tick : float
+        How often the owner asks for due collections, seconds
+    interval : float
+        Starting interval of new collections, seconds
+    minInterval, maxInterval : float
+        Bounds of the adapted intervals, seconds
+    budget : float
+        Polls per second allowed over all collections (one poll is usually one request),
+        overdue collections wait for the next tick, most overdue first
+    """
+
+    def __init__(self, tick: float = 1, interval: float = 10, minInterval: float = 2, maxInterval: float = 120, budget: float = 50, alpha: float = 0.3) -> None:
+        self.tick = tick
+        self.interval = interval
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.budget = budget
+        self.alpha = alpha
+
+        self.queue = []  # heap [(due time, generation, collectionID)]
+        self.counter = itertools.count(1)
+        self.generation = {}  # collectionID: generation of its valid queue entry
+        self.intervals = {}  # collectionID: current interval
+        self.velocity = {}  # collectionID: new listings per second
+        self.lastPoll = {}  # collectionID: time of the last poll
+
+        self.allowance = budget * tick
+        self.lastTick = time.monotonic()
+        self.overruns = 0
+
+    def add(self, collectionID: str):
+        self.intervals[collectionID] = self.interval
+        self.velocity[collectionID] = None
+        self._push(collectionID, time.monotonic())  # poll it right away
+
+    def remove(self, collectionID: str):
+        # queue entries are dropped lazily when popped
+        self.generation.pop(collectionID, None)
+        self.intervals.pop(collectionID, None)
+        self.velocity.pop(collectionID, None)
+        self.lastPoll.pop(collectionID, None)
+
+    def due(self) -> List[str]:
+        """
+        Pop collections whose time has come, as many as the budget allows,
+        they stay out of the queue until their poll is recorded
+        """
+        now = time.monotonic()
+        self.allowance = min(self.budget * self.tick, self.allowance + (now - self.lastTick) * self.budget)
+        self.lastTick = now
+
         result = []
+        while self.queue and self.queue[0][0] <= now and self.allowance >= 1:
+            _, generation, collectionID = heapq.heappop(self.queue)
+
+            if self.generation.get(collectionID) != generation:
+                continue  # removed or rescheduled
 
-        for nft in snapshot.list:
-            valid = True
+            self.generation[collectionID] = None  # in flight
+            self.allowance -= 1
+            result.append(collectionID)
 
-            for att, filter_func in self.filterData.data.items():
-                valid = valid and filter_func(nft.__dict__[att])
+        return result
 
-                if not valid:
-                    break
+    def claim(self, collectionID: str) -> bool:
+        "Take queued collection out of order, False when it is in flight already"
+        if self.generation.get(collectionID) is None:
+            return False
 
-            if valid:
-                result.append(nft)
+        self.generation[collectionID] = None
+        return True
 
-        return core.Snapshot(result)
+    def record(self, collectionID: str, newListings: int):
+        "Collection was polled, adapt its interval and put it back to the queue"
+        if not collectionID in self.intervals or self.generation.get(collectionID) is not None:
+            return  # removed, or not in flight (already recorded)
 
-    def update_snapshot(self, newSnapshot: core.Snapshot) -> core.Snapshot:
-        self.lastSnapshot = self.filter_snapshot(newSnapshot)
-        return self.lastSnapshot
+        now = time.monotonic()
+        lastPoll = self.lastPoll.get(collectionID)
+        self.lastPoll[collectionID] = now
+
+        if lastPoll is None:  # first poll only sets the baseline snapshot
+            self._push(collectionID, now + self.intervals[collectionID])
+            return
+
+        sample = newListings / max(now - lastPoll, 1e-3)
+        velocity = self.velocity[collectionID]
+        velocity = sample if velocity is None else (1 - self.alpha) * velocity + self.alpha * sample
+        self.velocity[collectionID] = velocity
+
+        # aim for about one new listing per poll
+        interval = 1 / velocity if velocity > 0 else self.maxInterval
+        interval = min(interval, self.intervals[collectionID] * 1.5)  # back off gradually when it quiets down
+        interval = max(self.minInterval, min(self.maxInterval, interval))
+
+        self.intervals[collectionID] = interval
+        self._push(collectionID, now + interval)
+
+    def finish_round(self, duration: float) -> bool:
+        "Returns True when the round took longer than the tick, i.e. the loop overran"
+        if duration <= self.tick:
+            return False
+
+        self.overruns += 1
+        return True
+
+    def stats(self) -> Dict[str, Dict]:
+        return {
+            collectionID: {"interval": interval, "velocity": self.velocity[collectionID]}
+            for collectionID, interval in self.intervals.items()
+        }
+
+# private:
+    def _push(self, collectionID: str, due: float):
+        generation = next(self.counter)
+
+        self.generation[collectionID] = generation
+        heapq.heappush(self.queue, (due, generation, collectionID))
 
 
 class Monitor:
-    def __init__(self, marketPage: core.MarketPage) -> None:
+    """
+    Parameters
+    ----------
+    concurrency : int
+        Collections fetched at once, by default derived from the number of loaded proxies
+    workers : int
+        Threads of the pool the monitor owns for blocking work, shared by the market and rank page
+    hostLimits : dict
+        {host: max requests in flight}, overrides network.HOST_LIMITS
+    floorInterval : float
+        Seconds between floor samples of one collection, the requests are spread over the interval
+    feed : bool
+        Read all collections from the market page's feed (a few multi-collection queries)
+        every feedInterval instead of scheduling a poll per collection
+    feedInterval : float
+        Seconds between feed reads, the scheduler's starting interval by default
+    """
+
+    def __init__(self, marketPage: core.MarketPage, concurrency: int = None, scheduler: Scheduler = None, queueSize: int = 100, notificationLimit: int = 1000, workers: int = POOL_WORKERS, hostLimits: Dict[str, int] = None, floorInterval: float = FLOOR_INTERVAL, feed: bool = False, feedInterval: float = None) -> None:
         self.collections = {}  # collectionID: CollectionData
         self.marketPage = marketPage
+        self.concurrency = concurrency if concurrency else max(FETCH_MIN, FETCH_PER_PROXY * len(network.proxies))  # max collections requested at once
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+        self.pool = WorkerPool(workers)  # lives as long as the monitor, never recreated per round
+        self.marketPage.executor = self.pool
+        if self.marketPage.rankPage is not None:
+            self.marketPage.rankPage.executor = self.pool
+
+        for host, limit in (hostLimits or {}).items():
+            network.hostLimiter.set_limit(host, limit)
+
+        self.queueSize = queueSize  # capacity of the queues between pipeline stages
+        self.queues = {}  # dict [stage name, queue feeding it], set while running
+        self.notificationLimit = notificationLimit
+        self.subscribers = []  # queues of (collectionID, nft), one per subscriber
+        self.tasks = []
+
+        self.history = History()  # recent listings and floor samples per collection
+        self.floorInterval = floorInterval
+
+        self.feed = feed
+        self.feedInterval = feedInterval if feedInterval is not None else self.scheduler.interval
+
+        metrics.registry.gauge("uzzi_queue_depth", "Items waiting in front of the pipeline stage", ("stage",),
+            collect=lambda: {(stage,): depth for stage, depth in self.stats()["queues"].items()})
+        metrics.registry.gauge("uzzi_notification_queue_depth", "Notifications waiting for the subscriber", ("subscriber",),
+            collect=lambda: {(str(i),): depth for i, depth in enumerate(self.stats()["notifications"])})
+        metrics.registry.gauge("uzzi_pool_utilisation", "Busy share of the worker pool threads",
+            collect=lambda: {(): self.pool.stats()["utilisation"]})
+        metrics.registry.gauge("uzzi_collections", "Monitored collections", collect=lambda: {(): len(self.collections)})
+        metrics.registry.gauge("uzzi_history_bytes", "Memory of the listing and floor history", collect=lambda: {(): self.history.nbytes})
+
+    def subscribe(self) -> asyncio.Queue:
+        "Queue receiving (collectionID, nft) for every alert"
+        queue = asyncio.Queue(maxsize=self.notificationLimit)
+        self.subscribers.append(queue)
+
+        return queue
+
+    async def run(self):
+        """
+        Poll in background until cancelled
+
+        Pipeline: schedule -> fetch -> rank -> diff -> filter -> emit, stages are connected
+        by bounded queues, so a slow stage makes the earlier ones wait instead of piling up work.
+        In the feed mode the feed stage takes the place of schedule and fetch.
+        """
+        fetchQueue, rankQueue, diffQueue, filterQueue, emitQueue = [asyncio.Queue(maxsize=self.queueSize) for _ in range(5)]
+        self.queues = {"fetch": fetchQueue, "rank": rankQueue, "diff": diffQueue, "filter": filterQueue, "emit": emitQueue}
+
+        if self.feed:
+            stages = [self._feed_stage(rankQueue)]
+        else:
+            stages = [self._schedule_stage(fetchQueue)]
+            stages += [self._stage(fetchQueue, rankQueue, self._fetch) for _ in range(self.concurrency)]
+
+        stages += [self._stage(rankQueue, diffQueue, self._rank) for _ in range(RANK_WORKERS)]
+        stages += [
+            self._stage(diffQueue, filterQueue, self._diff),
+            self._stage(filterQueue, emitQueue, self._filter),
+            self._stage(emitQueue, None, self._emit_collection),
+            self._floor_stage(),
+        ]
+
+        self.tasks = [asyncio.ensure_future(stage) for stage in stages]
+
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+    async def sample_floor(self, collectionID: str, wait: bool = True) -> float:
+        """
+        Floor of the collection from the market page's floor cache, None when unknown,
+        every sample is recorded to the collection's history
+
+        wait : bool
+            Await the refresh of a stale floor, the filters take the stale one rather than waiting
+        """
+        try:
+            floor, fetched = await self.marketPage.async_get_floor_stats(collectionID, wait)
+        except Exception as e:
+            debug_print(e.what() if isinstance(e, errors.CustomErr) else e, "Monitor")
+            return None
+
+        if floor is not None:
+            self.history[collectionID].add_floor(floor, fetched)
+
+        return floor
+
+    def stats(self) -> Dict[str, Dict]:
+        "Queue depths of the pipeline, worker pool and per host utilisation"
+        return {
+            "queues": {stage: queue.qsize() for stage, queue in self.queues.items()},
+            "notifications": [queue.qsize() for queue in self.subscribers],
+            "pool": self.pool.stats(),
+            "hosts": network.hostLimiter.stats(),
+        }
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+        self.pool.shutdown()
+
+    async def prime(self, collectionID: str) -> core.Snapshot:
+        "Poll just added collection right away, sets the baseline the later polls compare to"
+        if not self.scheduler.claim(collectionID):  # pipeline is polling it already
+            return core.Snapshot([])
+
+        return (await self.update_collection(self.collections[collectionID]))[1]
 
     async def update(self) -> Dict[str, core.Snapshot]:
         if self.collections == {}:
             raise errors.General(f"There are no collections in {self} monitor")
 
-        startTime = time.time_ns()
-        print("loop start ")
+        if self.feed:
+            return await self.update_feed()
+
+        dueCollections = [self.collections[collectionID] for collectionID in self.scheduler.due() if collectionID in self.collections]
 
-        with ThreadPoolExecutor(max_workers=100) as executor:
-            thread1 = executor.map(self.update_collection, self.collections.values())
+        if not dueCollections:
+            return {}
+
+        startTime = time.monotonic()
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited_update(collection: CollectionData):
+            async with semaphore:
+                return await self.update_collection(collection)
+
+        results = await asyncio.gather(
+            *[limited_update(collection) for collection in dueCollections],
+            return_exceptions=True)
+
+        rawSnaps = []
+        for result in results:
+            if isinstance(result, errors.CustomErr):
+                debug_print(result.what(), "Monitor", logging.ERROR)
+            elif isinstance(result, Exception):
+                debug_print(result, "Monitor")
+            else:
+                rawSnaps.append(result)
 
-        rawSnaps = [result for result in list(thread1)]
         validSnaps = list(filter(lambda snapTuple: not snapTuple[1].isEmpty(), rawSnaps)) 
         result = {snapTuple[0]: snapTuple[1] for snapTuple in validSnaps}
 
         if len(result):
             debug_print(f"Update result len: {len(result)}", "Monitor")
+            self._emit(result)
+
+        duration = time.monotonic() - startTime
+        metrics.roundSeconds.observe(duration)
 
-        print("loop done", time.time_ns() - startTime)
+        if self.scheduler.finish_round(duration):
+            debug_print(f"Loop overran tick {self.scheduler.tick}s, took {duration:.2f}s for {len(dueCollections)} collections", "Monitor", logging.WARNING)
 
         return result
 
-    def update_collection(self, collection: CollectionData) -> Tuple[str, core.Snapshot]:
-        snapshot = self.marketPage.get_snapshot(
-            collection.id, collection.rankID)
-        snapshot = collection.update_snapshot(snapshot)
+    async def update_feed(self) -> Dict[str, core.Snapshot]:
+        "All collections from one read of the feed, {collectionID: filtered snapshot} of the ones with alerts"
+        startTime = time.monotonic()
+
+        feed = await self.marketPage.async_fetch_feed(list(self.collections.keys()))
+        metrics.pollSeconds.observe(time.monotonic() - startTime)
+
+        async def process(collection: CollectionData, data: List[Dict]) -> Tuple[str, core.Snapshot]:
+            _, snapshot = await self._diff(*(await self._rank(collection, data)))
+            return (collection.id, await self._filter_snapshot(collection, snapshot))
+
+        results = await asyncio.gather(
+            *[process(self.collections[collectionID], data) for collectionID, data in feed.items() if collectionID in self.collections],
+            return_exceptions=True)
+
+        result = { }
+        for item in results:
+            if isinstance(item, Exception):
+                debug_print(item.what() if isinstance(item, errors.CustomErr) else item, "Monitor", logging.ERROR)
+            elif not item[1].isEmpty():
+                result[item[0]] = item[1]
+
+        if len(result):
+            self._emit(result)
+
+        metrics.roundSeconds.observe(time.monotonic() - startTime)
+
+        return result
+
+    async def update_collection(self, collection: CollectionData) -> Tuple[str, core.Snapshot]:
+        newListings = 0
+        startTime = time.monotonic()
+
+        try:
+            snapshot = await self.marketPage.async_get_snapshot(
+                collection.id, collection.rankID)
+            newListings = len(snapshot)
+        finally:
+            self.scheduler.record(collection.id, newListings)
+            self._observe_poll(collection, time.monotonic() - startTime)
+
+        metrics.diffListings.observe(newListings)
+        self.history[collection.id].add_listings(snapshot.list)
+
+        snapshot = await self._filter_snapshot(collection, snapshot)
 
         return (collection.id, snapshot)
 
+    def _emit(self, snapshots: Dict[str, core.Snapshot]):
+        for collectionID, snapshot in snapshots.items():
+            for nft in snapshot.list:
+                for queue in self.subscribers:
+                    try:
+                        queue.put_nowait((collectionID, nft))
+                    except asyncio.QueueFull:  # subscriber is far behind, polling must not wait for it
+                        debug_print(f"Notification queue full, dropped {nft.name}", "Monitor", logging.WARNING)
+
+# pipeline stages:
+    async def _schedule_stage(self, fetchQueue: asyncio.Queue):
+        while True:
+            startTime = time.monotonic()
+
+            for collectionID in self.scheduler.due():
+                if collectionID in self.collections:
+                    await fetchQueue.put((self.collections[collectionID],))
+
+            duration = time.monotonic() - startTime
+            if self.scheduler.finish_round(duration):  # fetching can't keep up with the due collections
+                debug_print(f"Loop overran tick {self.scheduler.tick}s, scheduling took {duration:.2f}s", "Monitor", logging.WARNING)
+
+            await asyncio.sleep(max(0, self.scheduler.tick - duration))
+
+    async def _feed_stage(self, rankQueue: asyncio.Queue):
+        while True:
+            startTime = time.monotonic()
+
+            try:
+                feed = await self.marketPage.async_fetch_feed(list(self.collections.keys())) if self.collections else { }
+                metrics.pollSeconds.observe(time.monotonic() - startTime)
+            except Exception as e:
+                debug_print(e.what() if isinstance(e, errors.CustomErr) else e, "Monitor")
+                feed = { }
+
+            for collectionID, data in feed.items():
+                if collectionID in self.collections:
+                    await rankQueue.put((self.collections[collectionID], data))
+
+            duration = time.monotonic() - startTime
+            if duration > self.feedInterval:
+                debug_print(f"Feed read took {duration:.2f}s, longer than its {self.feedInterval}s interval", "Monitor", logging.WARNING)
+
+            await asyncio.sleep(max(0, self.feedInterval - duration))
+
+    async def _stage(self, inQueue: asyncio.Queue, outQueue: asyncio.Queue, work):
+        while True:
+            item = await inQueue.get()
+
+            try:
+                result = await work(*item)
+            except Exception as e:
+                debug_print(e.what() if isinstance(e, errors.CustomErr) else e, "Monitor")
+                self.scheduler.record(item[0].id, 0)  # reschedule, ignored when already recorded
+                continue
+
+            if result is not None and outQueue is not None:
+                await outQueue.put(result)
+
+    async def _fetch(self, collection: CollectionData):
+        startTime = time.monotonic()
+
+        try:
+            return (collection, await self.marketPage.async_fetch_listings(collection.id))
+        finally:
+            self._observe_poll(collection, time.monotonic() - startTime)
+
+    async def _rank(self, collection: CollectionData, data: List[Dict]):
+        return (collection, data, await self.marketPage.async_rank_listings(collection.id, collection.rankID, data))
+
+    async def _diff(self, collection: CollectionData, data: List[Dict], snapshot: core.Snapshot):
+        snapshot = self.marketPage.diff_listings(collection.id, data, snapshot)
+        self.scheduler.record(collection.id, len(snapshot))
+        metrics.diffListings.observe(len(snapshot))
+        self.history[collection.id].add_listings(snapshot.list)
+
+        return (collection, snapshot)
+
+    async def _filter(self, collection: CollectionData, snapshot: core.Snapshot):
+        snapshot = await self._filter_snapshot(collection, snapshot)
+
+        return (collection, snapshot) if not snapshot.isEmpty() else None
+
+    async def _filter_snapshot(self, collection: CollectionData, snapshot: core.Snapshot) -> core.Snapshot:
+        floor = None
+        if collection.filterData.needsFloor and not snapshot.isEmpty():
+            floor = await self.sample_floor(collection.id, wait=False)
+
+        filtered = collection.update_snapshot(snapshot, floor, self._trait_index(collection))
+
+        # after filtering, the listings are compared to the floor from before they came
+        if not snapshot.isEmpty():
+            self.marketPage.undercut(collection.id, float(snapshot.columns()["price"].min()))
+
+        return filtered
+
+    def _trait_index(self, collection: CollectionData) -> rarity.TraitIndex:
+        "Full trait index for the attributes filter, None while it is built in background or the rank page lacks the collection"
+        if not "traits" in collection.filterData.parsed or self.marketPage.rankPage is None:
+            return None
+
+        try:
+            return self.marketPage.rankPage.get_trait_index(collection.rankID, wait=False)
+        except errors.CustomErr:
+            return None
+
+    async def _emit_collection(self, collection: CollectionData, snapshot: core.Snapshot):
+        debug_print(f"Found in collection: {collection.id}", "Monitor")
+        self._emit({collection.id: snapshot})
+
+    async def _floor_stage(self):
+        "Samples floors of all collections once per floorInterval, one request at a time"
+        while True:
+            collectionIDs = list(self.collections.keys())
+
+            for collectionID in collectionIDs:
+                await asyncio.sleep(self.floorInterval / len(collectionIDs))
+
+                if collectionID in self.collections:
+                    await self.sample_floor(collectionID)
+
+            if not collectionIDs:
+                await asyncio.sleep(self.scheduler.tick)
+
+    def _observe_poll(self, collection: CollectionData, duration: float):
+        metrics.pollSeconds.observe(duration)
+        metrics.collectionPollSeconds.set(duration, collection.id)
+
     def add_collection(self, collectionID: str, rankID: str, **filters) -> None:
         if not self.marketPage._check_collection(collectionID):
             raise errors.NotValidQuerry(f"CollectionID {collectionID}")
@@ -114,25 +627,20 @@ class Monitor:
         self.collections[collectionID] = CollectionData(
             collectionID, rankID, FilterData(**filters))
 
+        self.scheduler.add(collectionID)
+
+        if self.marketPage.rankPage is not None: # warm start ranks from disk, fetch missing in background
+            self.marketPage.rankPage.preload([rankID])
+
     def remove_collection(self, collectionID: str):
         if not collectionID in self.collections:
             raise errors.NotValidQuerry(f"CollectionID {collectionID}")
 
         self.collections.pop(collectionID)
+        self.scheduler.remove(collectionID)
+        self.history.remove(collectionID)
+        metrics.collectionPollSeconds.remove(collectionID)
 
     def load_collections(self, filePath: str):
-        with open(filePath, 'r') as f:
-            for rawLine in f.readlines():
-                if rawLine[0] == ';':
-                    continue
-
-                rawLine = rawLine.replace('\n', '')
-                ids, kwargs = rawLine.split(', ')
-                ids = ids.split(' ')
-                kwargs = kwargs.split(' ')
-
-                collectionID = ids[0]
-                rankID = ids[1] if len(ids) == 2 else collectionID.replace('_', '')
-                filters = parse_kwargs(kwargs)
-
-                self.add_collection(collectionID, rankID, **filters)
+        for collectionID, rankID, filters in read_collections(filePath):
+            self.add_collection(collectionID, rankID, **filters)
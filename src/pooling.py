@@ -1,41 +1,72 @@
-# from concurrent.futures import ThreadPoolExecutor
-# from time import sleep
-
-# def count_number_of_words(sentence):
-#   number_of_words = len(sentence.split())
-#   sleep(1)
-#   print("Number of words in the sentence :",sentence," : {}".format(number_of_words),end="\n")
-
-# def count_number_of_characters(sentence):
-#   number_of_characters = len(sentence)
-#   sleep(1)
-#   print("Number of characters in the sentence :",sentence," : {}".format(number_of_characters),end="\n")
-  
-# if __name__ == '__main__':
-#   sentence = "Python Multiprocessing is an important library for achieving parallel programming."  
-#   executor = ThreadPoolExecutor(4)
-#   thread1 = executor.submit(count_number_of_words, (sentence))
-#   thread2 = executor.submit(count_number_of_characters, (sentence))
-#   print("Thread 1 executed ? :",thread1.done())
-#   print("Thread 2 executed ? :",thread2.done())
-#   sleep(2)
-#   print("Thread 1 executed ? :",thread1.done())
-#   print("Thread 2 executed ? :",thread2.done())
-
-
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
-import numpy as np
-from time import sleep
-
-def log(n):
-    log_value = np.log(n)
-    sleep(1)
-    return log_value
-
-if __name__ == '__main__':
-    values = [1,10,100,1000]
-    with ThreadPoolExecutor(max_workers = 3) as executor:
-        thread1 = executor.map(log, values)
-    for result in thread1:
-        print(np.round(result,2))
+import asyncio
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
+
+
+class WorkerPool:
+    """
+    One long-lived thread pool for the blocking work of the Monitor
+
+    Rank revalidation, catalogue refreshes and other blocking calls share it,
+    instead of spawning a thread or a whole executor per job.
+
+    Parameters
+    ----------
+    workers : int
+        Threads in the pool, the total concurrency of blocking jobs
+    """
+
+    def __init__(self, workers: int = 16) -> None:
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="uzzi-worker")
+
+        self.queued = 0  # submitted, waiting for a thread
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        with self.lock:
+            self.queued += 1
+
+        return self.executor.submit(self._run, fn, *args, **kwargs)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        "Await blocking call done in the pool"
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "utilisation": self.running / self.workers,
+            }
+
+    def shutdown(self, wait: bool = False):
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+# private:
+    def _run(self, fn: Callable, *args, **kwargs):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            with self.lock:
+                self.failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+
+        return result
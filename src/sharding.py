@@ -0,0 +1,659 @@
+"""
+Monitoring split over several processes or hosts
+------------------------------------------------
+
+Workers run their own Monitor for a consistent-hash partition of the collections,
+through a disjoint share of the proxies. They stream the alerts back to one
+coordinator, which runs the discord bot (`shard_port` in .env) and rebalances
+when a worker joins, disconnects or stops sending heartbeats.
+
+Messages are json lines over plain tcp:
+
+    worker -> coordinator   hello {worker}, ping {stats}, listings {collection, nfts}, rejected {collections: [[collectionID, error]]}
+    coordinator -> worker   assign {collections: [[collectionID, rankID, filters]], proxies: [address]}
+
+Collection moved to another worker starts from a fresh baseline there, listings
+made between the last poll of the old owner and the first poll of the new one are not alerted.
+Collection a worker rejects goes to the next worker on the ring, once all of them
+rejected it, it is offered again after REJECT_RETRY.
+
+    python src/sharding.py coordinator --port 9500 --collections collections.txt
+    python src/sharding.py worker --coordinator 10.0.0.1:9500
+    python src/sharding.py local --workers 3 --api http://127.0.0.1:8400 --sample 20   # against src/standin.py
+
+* HashRing \n
+    Class, consistent hash of keys to nodes
+* Coordinator \n
+    Class, assigns collections and proxies to the workers, Monitor like interface for the bot
+* Worker \n
+    Class, Monitor of the assigned collections connected to the coordinator
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+from typing import Callable, Collection, Dict, Iterable, List, Tuple
+
+import meden
+import monitor
+from crossplatform import core, core_exceptions as errors, debug, decoding, metrics, network
+from crossplatform.debug import debug_print
+
+
+SHARD_PORT = 9500
+REPLICAS = 64 # points of every node on the ring, more even partitions at the cost of memory
+HEARTBEAT = 5 # seconds between pings of a worker
+HEARTBEAT_MISSES = 3 # worker silent for this many heartbeats is considered dead
+RETRY = 5 # seconds before a worker reconnects
+REJECT_RETRY = 60 # seconds before a collection rejected by every worker is assigned again
+LINE_LIMIT = 16 * 1024 * 1024 # bytes of one message
+
+
+class HashRing:
+    """
+    Keys are owned by the first node point clockwise from the key's hash,
+    adding or removing a node moves only the keys of its neighbourhood
+
+    Hashes are md5 based, python's hash() differs between processes
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = REPLICAS) -> None:
+        self.replicas = replicas
+        self.nodes = set()
+        self.points = [] # sorted hashes of the node points
+        self.owners = { } # dict [point hash, node]
+
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+
+        self.nodes.add(node)
+
+        for i in range(self.replicas):
+            point = _hash(f"{node}#{i}")
+            self.owners[point] = node
+            bisect.insort(self.points, point)
+
+    def remove(self, node: str):
+        if not node in self.nodes:
+            return
+
+        self.nodes.discard(node)
+        self.owners = {point: owner for point, owner in self.owners.items() if owner != node}
+        self.points = sorted(self.owners.keys())
+
+    def owner(self, key: str, exclude: Collection[str] = ()) -> str:
+        "Node owning the key, the next one clockwise while the owner is excluded, None when no node is left"
+        if not self.nodes - set(exclude):
+            return None
+
+        start = bisect.bisect(self.points, _hash(key))
+
+        for i in range(len(self.points)):
+            node = self.owners[self.points[(start + i) % len(self.points)]]
+            if not node in exclude:
+                return node
+
+    def partition(self, keys: Iterable[str], exclude: Dict[str, Collection[str]] = None) -> Dict[str, List[str]]:
+        "{node: [keys it owns]}, every node present, keys no node may own are left out"
+        result = {node: [] for node in self.nodes}
+        exclude = exclude if exclude is not None else { }
+
+        for key in keys:
+            owner = self.owner(key, exclude.get(key, ()))
+            if owner is not None:
+                result[owner].append(key)
+
+        return result
+
+
+def split_proxies(proxies: List[str], workers: List[str]) -> Dict[str, List[str]]:
+    """
+    {worker: [proxy addresses]}, round robin over the sorted workers so the shares
+    differ by one proxy at most, disjoint unless there are fewer proxies than workers
+    """
+    workers = sorted(workers)
+
+    if len(proxies) < len(workers): # everyone needs one, some are shared
+        return {worker: [proxies[i % len(proxies)]] if proxies else [] for i, worker in enumerate(workers)}
+
+    return {worker: proxies[i::len(workers)] for i, worker in enumerate(workers)}
+
+def nft_to_dict(nft: core.NFT) -> Dict:
+    return {
+        "id": nft.id,
+        "name": nft.name,
+        "token": nft.token,
+        "price": nft.price,
+        "image": nft.img,
+        "rank": nft.rank,
+        "attributes": nft.atts,
+        "listedAt": nft.listedAt,
+    }
+
+def nft_from_dict(data: Dict, traitTable: core.TraitTable = None) -> core.NFT:
+    return core.NFT(data["id"], data["name"], data["token"], data["price"], data["image"], data["rank"],
+        data["attributes"], traitTable, data.get("listedAt"))
+
+
+class WorkerLink:
+    "Coordinator's side of one connected worker"
+
+    def __init__(self, name: str, writer: asyncio.StreamWriter) -> None:
+        self.name = name
+        self.writer = writer
+        self.joined = time.monotonic()
+        self.lastSeen = self.joined
+
+        self.collections = None # collection ids assigned last, None before the first assignment
+        self.proxies = None
+        self.stats = { } # reported by the last ping
+
+
+class Coordinator:
+    """
+    Owns the list of collections and hands them to the connected workers,
+    alerts they send come out of subscribe() queues the same as from a Monitor
+
+    The coordinator polls nothing, its proxies are used only for the catalogue
+    download that validates new collections.
+
+    Parameters
+    ----------
+    marketPage : core.MarketPage
+        Validates collections, its trait tables decode the received nfts
+    proxies : list
+        Proxy addresses split between the workers
+    host, port : str, int
+        Address the workers connect to
+    heartbeat : float
+        Seconds between worker pings, silence for HEARTBEAT_MISSES of them drops the worker
+    """
+
+    def __init__(self, marketPage: core.MarketPage, proxies: List[str], host: str = "127.0.0.1", port: int = SHARD_PORT, heartbeat: float = HEARTBEAT, notificationLimit: int = 1000) -> None:
+        self.collections = {} # collectionID: CollectionData, same as Monitor.collections
+        self.specs = {} # dict [collectionID, (rankID, filters)], as the workers get them
+        self.marketPage = marketPage
+        self.proxies = proxies
+
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+
+        self.ring = HashRing()
+        self.workers = {} # dict [worker name, WorkerLink]
+        self.rejected = {} # dict [collectionID, set of workers that couldn't monitor it]
+        self.retry = None # timer offering the collections nobody took again
+        self.notificationLimit = notificationLimit
+        self.subscribers = [] # queues of (collectionID, nft), one per subscriber
+        self.dropped = 0 # listings sent by a worker not owning the collection anymore
+
+        metrics.registry.gauge("uzzi_collections", "Monitored collections", collect=lambda: {(): len(self.collections)})
+        metrics.registry.gauge("uzzi_shard_collections", "Collections assigned to the worker", ("worker",),
+            collect=lambda: {(name,): len(link.collections or []) for name, link in list(self.workers.items())})
+
+    def subscribe(self) -> asyncio.Queue:
+        "Queue receiving (collectionID, nft) for every alert of every worker"
+        queue = asyncio.Queue(maxsize=self.notificationLimit)
+        self.subscribers.append(queue)
+
+        return queue
+
+    async def run(self):
+        "Accept workers until cancelled"
+        server = await asyncio.start_server(self._serve_worker, self.host, self.port, limit=LINE_LIMIT)
+        debug_print(f"Coordinating workers on {self.host}:{self.port}", "Coordinator")
+
+        async with server:
+            await server.serve_forever()
+
+    def stats(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+
+        return {
+            "queues": { },
+            "notifications": [queue.qsize() for queue in self.subscribers],
+            "workers": {name: {
+                "collections": len(link.collections or []),
+                "proxies": len(link.proxies or []),
+                "last_seen": now - link.lastSeen,
+                **link.stats,
+            } for name, link in list(self.workers.items())},
+        }
+
+    async def prime(self, collectionID: str) -> core.Snapshot:
+        "The first poll of the owning worker sets the baseline"
+        return core.Snapshot([])
+
+    def add_collection(self, collectionID: str, rankID: str, **filters) -> None:
+        if not self.marketPage._check_collection(collectionID):
+            raise errors.NotValidQuerry(f"CollectionID {collectionID}")
+
+        if collectionID in self.collections.keys():
+            raise errors.General(
+                f"Collection {collectionID} is already in monitor")
+
+        self.collections[collectionID] = monitor.CollectionData(
+            collectionID, rankID, monitor.FilterData(**filters))
+        self.specs[collectionID] = (rankID, filters)
+
+        self._rebalance()
+
+    def remove_collection(self, collectionID: str):
+        if not collectionID in self.collections:
+            raise errors.NotValidQuerry(f"CollectionID {collectionID}")
+
+        self.collections.pop(collectionID)
+        self.specs.pop(collectionID)
+        self.rejected.pop(collectionID, None)
+
+        self._rebalance()
+
+    def load_collections(self, filePath: str):
+        for collectionID, rankID, filters in monitor.read_collections(filePath):
+            self.add_collection(collectionID, rankID, **filters)
+
+# private:
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        link = None
+
+        try:
+            hello = await asyncio.wait_for(_read(reader), self.heartbeat * HEARTBEAT_MISSES)
+            if hello is None or hello.get("type") != "hello":
+                return
+
+            link = self._join(hello["worker"], writer)
+
+            while True:
+                # any message counts as a heartbeat
+                message = await asyncio.wait_for(_read(reader), self.heartbeat * HEARTBEAT_MISSES)
+                if message is None:
+                    break
+
+                link.lastSeen = time.monotonic()
+                self._handle(link, message)
+        except asyncio.TimeoutError:
+            debug_print(f"Worker {link.name if link else writer.get_extra_info('peername')} stopped responding", "Coordinator", logging.WARNING)
+        except (ConnectionError, ValueError) as e:
+            debug_print(f"Worker {link.name if link else writer.get_extra_info('peername')} failed: {e}", "Coordinator", logging.WARNING)
+        finally:
+            if link is not None and self.workers.get(link.name) is link:
+                self._leave(link)
+
+            writer.close()
+
+    def _join(self, name: str, writer: asyncio.StreamWriter) -> WorkerLink:
+        previous = self.workers.get(name)
+        if previous is not None: # reconnected before its old connection timed out
+            previous.writer.close()
+
+        link = self.workers[name] = WorkerLink(name, writer)
+        self.ring.add(name)
+
+        debug_print(f"Worker {name} joined, {len(self.workers)} workers", "Coordinator")
+        self._rebalance()
+
+        return link
+
+    def _leave(self, link: WorkerLink):
+        self.workers.pop(link.name)
+        self.ring.remove(link.name)
+
+        for workers in self.rejected.values(): # it may come back with a working catalogue
+            workers.discard(link.name)
+
+        debug_print(f"Worker {link.name} left, {len(self.workers)} workers", "Coordinator", logging.WARNING)
+        self._rebalance()
+
+    def _handle(self, link: WorkerLink, message: Dict):
+        kind = message.get("type")
+
+        if kind == "listings":
+            collectionID = message["collection"]
+
+            if not collectionID in (link.collections or []): # sent before the worker got its new assignment
+                self.dropped += len(message["nfts"])
+                return
+
+            traitTable = self.marketPage.get_trait_table(collectionID)
+            self._emit(collectionID, [nft_from_dict(data, traitTable) for data in message["nfts"]])
+        elif kind == "ping":
+            link.stats = message.get("stats", { })
+        elif kind == "rejected":
+            self._reject(link, message["collections"])
+
+    def _reject(self, link: WorkerLink, rejected: List[Tuple[str, str]]):
+        "Move the collections to the next workers, the ones all workers rejected are tried again later"
+        for collectionID, error in rejected:
+            debug_print(f"Worker {link.name} rejected {collectionID}: {error}", "Coordinator", logging.WARNING)
+
+            if not collectionID in self.specs: # removed meanwhile
+                continue
+
+            workers = self.rejected.setdefault(collectionID, set())
+            if not self.ring.nodes - workers: # already waiting for the retry
+                continue
+
+            workers.add(link.name)
+
+            if not self.ring.nodes - workers:
+                debug_print(f"No worker can monitor {collectionID}, assigning again in {REJECT_RETRY}s", "Coordinator", logging.WARNING)
+
+                if self.retry is None:
+                    self.retry = asyncio.get_running_loop().call_later(REJECT_RETRY, self._retry)
+
+        self._rebalance()
+
+    def _retry(self):
+        "Collections rejected by every worker are assigned again, the ones some worker monitors stay where they are"
+        self.retry = None
+        unmonitored = [collectionID for collectionID, workers in self.rejected.items() if not self.ring.nodes - workers]
+
+        for collectionID in unmonitored:
+            self.rejected.pop(collectionID)
+
+        if unmonitored:
+            self._rebalance()
+
+    def _emit(self, collectionID: str, nfts: List[core.NFT]):
+        for nft in nfts:
+            for queue in self.subscribers:
+                try:
+                    queue.put_nowait((collectionID, nft))
+                except asyncio.QueueFull:
+                    debug_print(f"Notification queue full, dropped {nft.name}", "Coordinator", logging.WARNING)
+
+    def _rebalance(self):
+        "Send the new partition to the workers whose share changed"
+        partition = self.ring.partition(self.specs.keys(), self.rejected)
+        proxies = split_proxies(self.proxies, list(self.workers.keys()))
+
+        for name, link in list(self.workers.items()):
+            collections = sorted(partition.get(name, []))
+
+            if collections == link.collections and proxies[name] == link.proxies:
+                continue
+
+            link.collections = collections
+            link.proxies = proxies[name]
+
+            try:
+                _send(link.writer, {
+                    "type": "assign",
+                    "collections": [[collectionID, *self.specs[collectionID]] for collectionID in collections],
+                    "proxies": link.proxies,
+                })
+            except (ConnectionError, RuntimeError) as e: # its connection handler drops it
+                debug_print(f"Assignment of worker {name} failed: {e}", "Coordinator", logging.WARNING)
+
+        if self.workers:
+            debug_print(f"Rebalanced {len(self.specs)} collections over {len(self.workers)} workers", "Coordinator")
+
+
+class Worker:
+    """
+    Polls the collections the coordinator assigns, through the assigned proxies,
+    reconnects when the connection drops (meanwhile its collections are given to the others)
+
+    Parameters
+    ----------
+    newPage : callable
+        Builds the page the Monitor polls, called once the first proxies are assigned
+        (the page starts downloading its catalogue right away)
+    coordinator : str
+        host:port of the coordinator
+    name : str
+        Unique name of the worker, hostname-pid by default
+    monitorArgs :
+        Passed to Monitor, created once the first proxies are assigned
+    """
+
+    def __init__(self, newPage: Callable[[], core.MarketPage], coordinator: str, name: str = None, heartbeat: float = HEARTBEAT, retry: float = RETRY, **monitorArgs) -> None:
+        self.newPage = newPage
+        self.marketPage = None # built with the monitor
+        self.host, _, port = coordinator.rpartition(':')
+        self.port = int(port)
+        self.name = name if name else f"{socket.gethostname()}-{os.getpid()}"
+        self.heartbeat = heartbeat
+        self.retry = retry
+
+        self.monitorArgs = monitorArgs
+        self.monitor = None
+        self.specs = { } # dict [collectionID, (rankID, filters)], as assigned
+        self.writer = None # connection to the coordinator, None while disconnected
+        self.tasks = []
+
+    async def run(self):
+        "Work until cancelled"
+        try:
+            while True:
+                try:
+                    reader, self.writer = await asyncio.open_connection(self.host, self.port, limit=LINE_LIMIT)
+                except OSError as e:
+                    debug_print(f"Coordinator {self.host}:{self.port} unreachable: {e}", "Worker", logging.WARNING)
+                    await asyncio.sleep(self.retry)
+                    continue
+
+                try:
+                    await self._session(reader)
+                except (ConnectionError, ValueError) as e:
+                    debug_print(f"Connection to the coordinator failed: {e}", "Worker", logging.WARNING)
+                finally:
+                    self.writer.close()
+                    self.writer = None
+                    await self._assign([]) # the coordinator gives them to the others meanwhile
+
+                await asyncio.sleep(self.retry)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+
+            if self.monitor is not None:
+                self.monitor.close()
+
+# private:
+    async def _session(self, reader: asyncio.StreamReader):
+        _send(self.writer, {"type": "hello", "worker": self.name})
+        await self.writer.drain()
+
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+
+        try:
+            while True:
+                message = await _read(reader)
+                if message is None:
+                    debug_print("Coordinator closed the connection", "Worker", logging.WARNING)
+                    return
+
+                if message.get("type") == "assign":
+                    rejected = await self._assign(message["collections"], message["proxies"])
+
+                    if rejected:
+                        _send(self.writer, {"type": "rejected", "collections": rejected})
+        finally:
+            heartbeat.cancel()
+
+    async def _assign(self, collections: List[Tuple[str, str, Dict]], proxies: List[str] = None) -> List[Tuple[str, str]]:
+        "Apply new assignment, returns [(collectionID, error)] of the collections that can't be monitored"
+        if proxies is not None:
+            network.replace_proxies(proxies)
+
+        if self.monitor is None:
+            if not collections:
+                return []
+
+            self.marketPage = self.newPage()
+            self.monitor = monitor.Monitor(self.marketPage, **self.monitorArgs)
+            notifications = self.monitor.subscribe()
+            self.tasks = [asyncio.ensure_future(self.monitor.run()), asyncio.ensure_future(self._forward(notifications))]
+
+        wanted = {collectionID: (rankID, filters) for collectionID, rankID, filters in collections}
+        rejected = []
+
+        for collectionID in list(self.monitor.collections.keys()):
+            if wanted.get(collectionID) != self.specs.get(collectionID): # moved away or its filters changed
+                self.monitor.remove_collection(collectionID)
+                self.specs.pop(collectionID, None)
+
+        added = [collectionID for collectionID in wanted.keys() if not collectionID in self.monitor.collections]
+
+        if added:
+            try:
+                # first download waits up to CATALOGUE_WAIT, the heartbeats go on meanwhile
+                await asyncio.get_running_loop().run_in_executor(None, self._load_catalogues)
+            except errors.CustomErr as e:
+                debug_print(e.what(), "Worker", logging.WARNING)
+                rejected = [(collectionID, e.what()) for collectionID in added]
+                added = []
+
+        for collectionID in added:
+            rankID, filters = wanted[collectionID]
+
+            try:
+                self.monitor.add_collection(collectionID, rankID, **filters)
+                self.specs[collectionID] = (rankID, filters)
+            except errors.CustomErr as e:
+                debug_print(e.what(), "Worker")
+                rejected.append((collectionID, e.what()))
+
+        debug_print(f"Assigned {len(self.monitor.collections)} collections, {len(network.proxies)} proxies", "Worker")
+
+        return rejected
+
+    def _load_catalogues(self):
+        "Blocks until the pages have their catalogues, add_collection checks against them"
+        self.marketPage.collections
+
+        if self.marketPage.rankPage is not None:
+            self.marketPage.rankPage.collections
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+
+            stats = {"proxies": len(network.proxies)}
+            if self.monitor is not None:
+                stats["queues"] = self.monitor.stats()["queues"]
+
+            _send(self.writer, {"type": "ping", "stats": stats})
+            await self.writer.drain()
+
+    async def _forward(self, notifications: asyncio.Queue):
+        "Stream the monitor's alerts to the coordinator, one message per collection and burst"
+        while True:
+            batch = [await notifications.get()]
+            while not notifications.empty():
+                batch.append(notifications.get_nowait())
+
+            if self.writer is None: # disconnected, the collections are someone else's by now
+                continue
+
+            grouped = { }
+            for collectionID, nft in batch:
+                grouped.setdefault(collectionID, []).append(nft_to_dict(nft))
+
+            try:
+                for collectionID, nfts in grouped.items():
+                    _send(self.writer, {"type": "listings", "collection": collectionID, "nfts": nfts})
+
+                await self.writer.drain()
+            except (ConnectionError, RuntimeError) as e:
+                debug_print(f"Alerts not delivered: {e}", "Worker", logging.WARNING)
+
+
+def run_worker(coordinator: str, name: str = None, api: str = None, howrareApi: str = None, **monitorArgs):
+    "Worker with its own pages, for use in a child process"
+    name = name if name else f"{socket.gethostname()}-{os.getpid()}"
+    debug.setup(path=f"temp/log-{name}.txt") # processes rotating one file would overwrite each other
+
+    def new_page() -> core.MarketPage:
+        return meden.Magiceden(api=api or meden.MAGICEDEN_API,
+            rankPage=meden.Howrare(howrareApi or api or meden.HOWRARE_API))
+
+    asyncio.run(Worker(new_page, coordinator, name, **monitorArgs).run())
+
+# private:
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+async def _read(reader: asyncio.StreamReader) -> Dict:
+    "Next message, None once the other side closed the connection"
+    line = await reader.readline()
+    return decoding.loads(line) if line else None
+
+def _send(writer: asyncio.StreamWriter, message: Dict):
+    if writer is None or writer.is_closing():
+        raise ConnectionError("not connected")
+
+    writer.write(decoding.dumps(message).encode("utf-8") + b"\n")
+
+
+async def _print_alerts(coordinator: Coordinator):
+    queue = coordinator.subscribe()
+
+    while True:
+        collectionID, nft = await queue.get()
+        print(f"{time.strftime('%H:%M:%S')} {collectionID}: {nft.name} for {nft.price} SOL, rank {nft.rank}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monitoring split over worker processes")
+    parser.add_argument("role", choices=["coordinator", "worker", "local"], help="local runs the coordinator and --workers child processes")
+    parser.add_argument("--host", default="127.0.0.1", help="address the coordinator listens on")
+    parser.add_argument("--port", type=int, default=SHARD_PORT)
+    parser.add_argument("--coordinator", default=f"127.0.0.1:{SHARD_PORT}", help="host:port, for the worker")
+    parser.add_argument("--name", default=None, help="worker name, hostname-pid by default")
+    parser.add_argument("--workers", type=int, default=3, help="worker processes in the local mode")
+    parser.add_argument("--collections", default="collections.txt")
+    parser.add_argument("--sample", type=int, default=0, help="monitor the first N collections of the catalogue instead")
+    parser.add_argument("--proxies", default="proxies.txt")
+    parser.add_argument("--api", default=None, help="magiceden api, src/standin.py for offline runs")
+    parser.add_argument("--howrare-api", default=None, help="howrare api, --api when not set")
+    parser.add_argument("--feed", action="store_true", help="workers read their collections from multi-collection feed queries")
+    args = parser.parse_args()
+
+    if args.role == "worker":
+        run_worker(args.coordinator, args.name, args.api, args.howrare_api, feed=args.feed)
+    else:
+        proxies = network.read_proxies(args.proxies)
+        network.load_proxies(args.proxies) # only for the catalogue
+
+        marketPage = meden.Magiceden(api=args.api or meden.MAGICEDEN_API,
+            rankPage=meden.Howrare(args.howrare_api or args.api or meden.HOWRARE_API))
+        coordinator = Coordinator(marketPage, proxies, args.host, args.port)
+
+        if args.sample:
+            for collectionID in sorted(marketPage.collections)[:args.sample]:
+                coordinator.add_collection(collectionID, collectionID)
+        else:
+            coordinator.load_collections(args.collections)
+
+        children = []
+        if args.role == "local":
+            for i in range(args.workers):
+                child = multiprocessing.Process(target=run_worker, daemon=True,
+                    args=(f"127.0.0.1:{args.port}", f"worker{i}", args.api, args.howrare_api), kwargs={"feed": args.feed})
+                child.start()
+                children.append(child)
+
+        async def start():
+            await asyncio.gather(coordinator.run(), _print_alerts(coordinator))
+
+        try:
+            asyncio.run(start())
+        finally:
+            for child in children:
+                child.kill()
@@ -0,0 +1,257 @@
+"""
+Local stand-in for the Magiceden and Howrare apis
+-------------------------------------------------
+
+Serves synthetic collections with listings appearing at a configurable rate,
+so the monitor can be benchmarked without touching the network.
+Both apis share one port, point Magiceden(api=...) and Howrare(api=...) to it.
+It also works as a plain http proxy, requests sent through it are answered by it.
+
+    python src/standin.py --collections 100 --rate 0.1 --latency 0.05
+
+* StandIn \n
+    Class, state of the synthetic market and the aiohttp application serving it
+* serve \n
+    Function, runs StandIn on a port until killed, for use in a child process
+"""
+
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+
+from aiohttp import web
+from typing import Dict, List
+
+
+SUPPLY = 1000 # tokens per collection
+HISTORY = 500 # listings kept per collection, older ones are delisted
+TRAITS = {
+    "Background": ["Red", "Blue", "Green", "Gold", "Black"],
+    "Hat": ["None", "Cap", "Crown", "Helmet"],
+    "Eyes": ["Normal", "Laser", "Closed"],
+}
+
+
+class StandIn:
+    """
+    Parameters
+    ----------
+    collections : int
+        Number of collections, named bench00000, bench00001, ...
+    listingRate : float
+        New listings per second in every collection (poisson arrivals)
+    latency, jitter : float
+        Mean and standard deviation of the delay added to every response, seconds
+    throttleRate : float
+        Probability of answering any request with 429
+    limit : float
+        Requests per second over all clients, more are answered with 429, 0 is no limit
+    """
+
+    def __init__(self, collections: int = 10, listingRate: float = 0.05, latency: float = 0, jitter: float = 0,
+            throttleRate: float = 0, limit: float = 0, seed: int = 0) -> None:
+        self.names = [f"bench{i:05d}" for i in range(collections)]
+        self.listingRate = listingRate
+        self.latency = latency
+        self.jitter = jitter
+        self.throttleRate = throttleRate
+        self.limit = limit
+
+        self.random = random.Random(seed)
+        self.listings = {name: [] for name in self.names} # newest last
+        self.nextListing = { }
+        self.counter = 0
+
+        self.requests = 0
+        self.throttled = 0
+        self.tokens = limit
+        self.updated = time.monotonic()
+
+        now = time.time()
+        for name in self.names: # a page of older listings to start from
+            for createdAt in sorted(now - self.random.uniform(60, 3600) for _ in range(20)):
+                self._list(name, createdAt)
+
+            self.nextListing[name] = now + self._arrival()
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/all_collections", self.all_collections),
+            web.get("/rpc/getListedNFTsByQuery", self.listed_nfts),
+            web.get("/rpc/getCollectionEscrowStats/{collection}", self.escrow_stats),
+            web.get("/api/v0.1/collections", self.rank_collections),
+            web.get("/api/v0.1/collections/{collection}", self.rank_collection_full),
+            web.get("/api/v0.1/collections/{collection}/only_rarity", self.rank_collection),
+            web.get("/_bench/stats", self.stats),
+        ])
+
+        return app
+
+    def rank(self, token: int) -> int:
+        "Fixed permutation of the tokens, the same in every collection"
+        return (token * 7919) % SUPPLY + 1
+
+    def attributes(self, token: int) -> List[Dict]:
+        return [{"trait_type": traitType, "value": values[(token * (i + 3)) % len(values)]}
+            for i, (traitType, values) in enumerate(TRAITS.items())]
+
+# magiceden:
+    async def all_collections(self, request: web.Request) -> web.Response:
+        return await self._respond({"collections": [
+            {"symbol": name, "name": name.title(), "description": "Synthetic collection " * 10, "image": ""}
+            for name in self.names]})
+
+    async def listed_nfts(self, request: web.Request) -> web.Response:
+        query = json.loads(request.query["q"])
+        match = query["$match"]["collectionSymbol"]
+        skip, limit = (query.get("$skip", 0), query.get("$limit", 20))
+
+        names = match["$in"] if isinstance(match, dict) else [match] # {"$in": [...]} is the feed of several collections
+        for name in names:
+            self._advance(name)
+
+        newest = sorted((listing for name in names for listing in self.listings.get(name, [])), key=lambda listing: listing["created"], reverse=True)
+
+        return await self._respond({"results": newest[skip:skip + limit]})
+
+    async def escrow_stats(self, request: web.Request) -> web.Response:
+        name = request.match_info["collection"]
+        self._advance(name)
+        prices = [listing["price"] for listing in self.listings.get(name, [])]
+
+        return await self._respond({"results": {"symbol": name, "floorPrice": int(min(prices, default=0) * 1e9), "listedCount": len(prices)}})
+
+# howrare:
+    async def rank_collections(self, request: web.Request) -> web.Response:
+        return await self._respond({"result": {"data": [{"url": f"/{name}", "name": name.title()} for name in self.names]}})
+
+    async def rank_collection(self, request: web.Request) -> web.Response:
+        name = request.match_info["collection"]
+
+        return await self._respond({"result": {"data": {
+            "collection": {"name": name},
+            "items": [{"link": f"/{name}/{token}", "rank": self.rank(token)} for token in range(1, SUPPLY + 1)]}}})
+
+    async def rank_collection_full(self, request: web.Request) -> web.Response:
+        name = request.match_info["collection"]
+
+        return await self._respond({"result": {"data": {
+            "collection": {"name": name},
+            "items": [{"link": f"/{name}/{token}", "rank": self.rank(token),
+                "attributes": [{"name": att["trait_type"], "value": att["value"]} for att in self.attributes(token)]}
+                for token in range(1, SUPPLY + 1)]}}})
+
+# benchmark:
+    async def stats(self, request: web.Request) -> web.Response:
+        "Counters and [id, created at] of listings created after ?since= (unix time)"
+        since = float(request.query.get("since", 0))
+        for name in self.names:
+            self._advance(name)
+
+        return web.json_response({
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "listings": {name: [[listing["id"], listing["created"]] for listing in listings if listing["created"] > since]
+                for name, listings in self.listings.items()},
+        })
+
+# private:
+    async def _respond(self, body: Dict) -> web.Response:
+        self.requests += 1
+
+        delay = self.random.gauss(self.latency, self.jitter) if self.jitter else self.latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if self._throttle():
+            self.throttled += 1
+            return web.json_response({"error": "Too many requests"}, status=429,
+                headers={"Retry-After": "1", "X-RateLimit-Limit": str(int(self.limit)), "X-RateLimit-Remaining": "0"})
+
+        headers = {"X-RateLimit-Limit": str(int(self.limit)), "X-RateLimit-Remaining": str(int(self.tokens))} if self.limit else {}
+
+        return web.json_response(body, headers=headers)
+
+    def _throttle(self) -> bool:
+        if self.throttleRate and self.random.random() < self.throttleRate:
+            return True
+
+        if not self.limit:
+            return False
+
+        now = time.monotonic()
+        self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit)
+        self.updated = now
+
+        if self.tokens < 1:
+            return True
+
+        self.tokens -= 1
+        return False
+
+    def _arrival(self) -> float:
+        return self.random.expovariate(self.listingRate) if self.listingRate > 0 else float("inf")
+
+    def _advance(self, name: str):
+        "Create the listings due since the last request for the collection"
+        now = time.time()
+
+        while name in self.nextListing and self.nextListing[name] <= now:
+            self._list(name, self.nextListing[name])
+            self.nextListing[name] += self._arrival()
+
+    def _list(self, name: str, createdAt: float):
+        self.counter += 1
+        token = self.random.randint(1, SUPPLY)
+
+        self.listings[name].append({
+            "id": f"{name}-{self.counter}",
+            "title": f"{name.title()} #{token}",
+            "collectionName": name,
+            "mintAddress": f"mint{self.counter}",
+            "price": round(self.random.uniform(0.5, 50), 2),
+            "img": "",
+            "attributes": self.attributes(token),
+            "createdAt": datetime.datetime.fromtimestamp(createdAt, datetime.timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "created": createdAt,
+        })
+
+        del self.listings[name][:-HISTORY]
+
+
+def serve(standIn: StandIn, port: int = 0, ready=None):
+    "Run until killed, the bound port is put to `ready` (multiprocessing queue)"
+    async def start():
+        runner = web.AppRunner(standIn.app(), access_log=None)
+        await runner.setup()
+
+        site = web.TCPSite(runner, "127.0.0.1", port)
+        await site.start()
+
+        boundPort = runner.addresses[0][1]
+        if ready is not None:
+            ready.put(boundPort)
+        else:
+            print(f"stand-in listening on http://127.0.0.1:{boundPort}")
+
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Magiceden/Howrare stand-in")
+    parser.add_argument("--port", type=int, default=8400)
+    parser.add_argument("--collections", type=int, default=10)
+    parser.add_argument("--rate", type=float, default=0.05, help="new listings per second per collection")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--jitter", type=float, default=0)
+    parser.add_argument("--throttle", type=float, default=0, help="probability of 429")
+    parser.add_argument("--limit", type=float, default=0, help="requests per second before 429")
+    args = parser.parse_args()
+
+    serve(StandIn(args.collections, args.rate, args.latency, args.jitter, args.throttle, args.limit), args.port)